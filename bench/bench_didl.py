@@ -0,0 +1,147 @@
+# Per-request cost of parsing CurrentURIMetaData, on payloads shaped like
+# what Bilibili, Huya and Samsung apps send, plus one with embedded art.
+# "envelope" is the SetAVTransportURI SOAP body being parsed first, which
+# tiny-render does for every request, cached metadata or not.
+#
+#   $ python bench/bench_didl.py
+import base64
+import html
+import os
+import re
+import sys
+import timeit
+import xml.etree.ElementTree as ET
+
+from xml.sax.saxutils import escape as xmlescape
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tiny_dlna.tiny_didl import didl_cache, parse_didl  # NOQA
+from tiny_dlna.tiny_render import parse_action_args  # NOQA
+
+DIDL_HEAD = (
+    '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" '
+    'xmlns:sec="http://www.sec.co.kr/">'
+)
+
+BILIBILI = (
+    DIDL_HEAD
+    + '<item id="123" parentID="-1" restricted="1">'
+    '<upnp:storageMedium>UNKNOWN</upnp:storageMedium>'
+    '<upnp:writeStatus>UNKNOWN</upnp:writeStatus>'
+    '<dc:title>【4K】哔哩哔哩 - 测试视频 &amp; 字幕</dc:title>'
+    '<upnp:class>object.item.videoItem</upnp:class>'
+    '<res protocolInfo="http-get:*:video/mp4:*">'
+    'https://upos-sz-mirror.bilivideo.com/upgcxcode/1.mp4?e=ig8euxZM2rNcNbdlhoNvNC8BqJIzNbfq&amp;uipk=5&amp;nbs=1'
+    '</res></item></DIDL-Lite>'
+)
+
+# unescaped `&` in URLs, an undeclared prefix, and HTML entities
+HUYA = (
+    '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+    '<item id="0" parentID="0" restricted="0">'
+    '<dc:title>虎牙直播&nbsp;LOL MSI</dc:title>'
+    '<upnp:class>object.item.videoItem</upnp:class>'
+    '<res protocolInfo="http-get:*:video/x-flv:*">'
+    'http://al.flv.huya.com/src/1.flv?wsSecret=abc&wsTime=66&fm=RFdxOEJjSjNoNkRKdDZUWV8kMF8kMV8kMl8kMw'
+    '</res></item></DIDL-Lite>'
+)
+
+SAMSUNG = (
+    DIDL_HEAD
+    + '<item id="f-0" parentID="0" restricted="1">'
+    '<dc:title>bar.mp4</dc:title>'
+    '<upnp:class>object.item.videoItem.movie</upnp:class>'
+    '<sec:CaptionInfoEx sec:type="srt">http://192.168.1.2:50000/videos/bar.srt</sec:CaptionInfoEx>'
+    '<sec:CaptionInfo sec:type="srt">http://192.168.1.2:50000/videos/bar.srt</sec:CaptionInfo>'
+    '<res protocolInfo="http-get:*:video/mp4:DLNA.ORG_OP=01">http://192.168.1.2:50000/videos/bar.mp4</res>'
+    '<res protocolInfo="http-get:*:text/srt:*">http://192.168.1.2:50000/videos/bar.srt</res>'
+    '</item></DIDL-Lite>'
+)
+
+ART = base64.b64encode(os.urandom(600 * 1024)).decode('ascii')
+ALBUM_ART = (
+    DIDL_HEAD
+    + '<item id="1" parentID="0" restricted="1">'
+    '<dc:title>with album art</dc:title>'
+    '<res protocolInfo="http-get:*:audio/mpeg:*">http://10.0.0.5:8200/song.mp3</res>'
+    f'<upnp:albumArtURI>data:image/jpeg;base64,{ART}</upnp:albumArtURI>'
+    '</item></DIDL-Lite>'
+)
+
+PAYLOADS = {
+    'bilibili': BILIBILI,
+    'huya': HUYA,
+    'samsung': SAMSUNG,
+    'samsung (escaped twice)': html.escape(SAMSUNG),
+    'album art (800 KB)': ALBUM_ART,
+}
+
+
+def get_envelope(metadata):
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<s:Body><u:SetAVTransportURI xmlns:u="urn:schemas-upnp-org:service:AVTransport:1">'
+        '<InstanceID>0</InstanceID><CurrentURI>http://x/</CurrentURI>'
+        f'<CurrentURIMetaData>{xmlescape(metadata)}</CurrentURIMetaData>'
+        '</u:SetAVTransportURI></s:Body></s:Envelope>'
+    ).encode('utf-8')
+
+
+def legacy_get_metadata(current_uri, metadata):
+    # what tiny-render did before tiny_didl, for comparison
+    metadata = html.unescape(metadata)
+    try:
+        metadata = metadata.replace('&', '&amp;')
+        metadata = ET.fromstring(metadata.strip())
+    except ET.ParseError:
+        m = re.search(r'<dc:title>(.*?)</dc:title>', metadata, re.DOTALL)
+        return {'video': current_uri, 'title': m.group(1) if m else ''}
+
+    ns = {
+        'dc': 'http://purl.org/dc/elements/1.1/',
+        '': 'urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/'
+    }
+    item = metadata.find('.//item', namespaces=ns)
+    obj = item.find('.//dc:title', namespaces=ns)
+    title = obj.text if obj is not None else ''
+    srt = ''
+    elem = item.find('.//{http://www.sec.co.kr/}CaptionInfoEx')
+    if elem is not None and elem.text:
+        srt = elem.text.strip()
+    return {'video': current_uri, 'srt': srt, 'title': title}
+
+
+def bench(func, payload, number):
+    return min(timeit.repeat(lambda: func('http://x/', payload), number=number, repeat=5)) / number
+
+
+def main():
+    print(f'{"payload":<26}{"size":>10}{"envelope":>12}{"legacy":>12}{"tiny_didl":>12}'
+          f'{"cached":>12}')
+    for name, payload in PAYLOADS.items():
+        number = 20 if len(payload) > 100000 else 2000
+        try:
+            legacy = f'{bench(legacy_get_metadata, payload, number) * 1e6:.1f} us'
+        except Exception as e:
+            legacy = type(e).__name__
+        new = bench(parse_didl, payload, number) * 1e6
+        # a controller resending the same SetAVTransportURI
+        cached = bench(didl_cache.parse, payload, number) * 1e6
+        body = get_envelope(payload)
+        envelope = min(timeit.repeat(
+            lambda: parse_action_args(body), number=number, repeat=5)) / number * 1e6
+        print(f'{name:<26}{len(payload):>10}{envelope:>9.1f} us{legacy:>12}'
+              f'{new:>9.1f} us{cached:>9.1f} us')
+
+    print()
+    for name, payload in PAYLOADS.items():
+        print(f'{name}: {parse_didl("", payload)}')
+
+
+if __name__ == '__main__':
+    main()
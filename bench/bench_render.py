@@ -0,0 +1,354 @@
+# Load test of tiny-render's SOAP control and SSDP search paths. A render
+# is started here with the stub mpv of bench/stub, so this runs headless.
+#
+#   $ python bench/bench_render.py
+#   $ python bench/bench_render.py --scenario poll --concurrency 32 --duration 10
+#   $ python bench/bench_render.py --skip-soap --ssdp-rate 2000
+#
+# Latencies are as seen by the client, CPU is the render process only.
+# The clients run on the same machine, keep that in mind on small boxes.
+# The render gets a HOME of its own, so nothing is left in the real
+# ~/.config/tiny-dlna; it still announces itself on the local network
+# for as long as it runs.
+import argparse
+import collections
+import http.client
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+from bench_didl import PAYLOADS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from tiny_dlna.tiny_ssdp import DEDUP_WINDOW  # NOQA
+
+AVT_TYPE = 'urn:schemas-upnp-org:service:AVTransport:1'
+SSDP_ADDR = ('127.0.0.1', 1900)
+M_SEARCH = (
+    'M-SEARCH * HTTP/1.1\r\n'
+    'HOST: 239.255.255.250:1900\r\n'
+    'MAN: "ssdp:discover"\r\n'
+    f'ST: {AVT_TYPE}\r\n'
+    '\r\n'
+).encode('utf-8')
+
+ENVELOPE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    '<s:Body><u:{action} xmlns:u="' + AVT_TYPE + '">'
+    '<InstanceID>0</InstanceID>{args}'
+    '</u:{action}></s:Body></s:Envelope>'
+)
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def soap_request(action, args=''):
+    body = ENVELOPE.replace('{action}', action).replace('{args}', args).encode('utf-8')
+    headers = {
+        'Content-Type': 'text/xml; charset="utf-8"',
+        'SOAPACTION': f'"{AVT_TYPE}#{action}"',
+    }
+    return action, body, headers
+
+
+def set_uri_request(uri, metadata=''):
+    args = f'<CurrentURI>{_escape(uri)}</CurrentURI>'
+    args += f'<CurrentURIMetaData>{_escape(metadata)}</CurrentURIMetaData>'
+    return soap_request('SetAVTransportURI', args)
+
+
+# what one worker sends, over and over
+SCENARIOS = {
+    # a controller showing the progress bar, once a second in real life
+    'poll': [
+        soap_request('GetPositionInfo'),
+        soap_request('GetTransportInfo'),
+    ],
+    # casting from the apps bench_didl.py has payloads of
+    'setav': [
+        set_uri_request(f'http://192.0.2.1/{name}.mp4', payload)
+        for name, payload in PAYLOADS.items()
+    ],
+    # picking something, watching for a moment, stopping; as all workers
+    # share one render, their Plays and Stops interleave
+    'play': [
+        set_uri_request('http://192.0.2.1/video.mp4', PAYLOADS['bilibili']),
+        soap_request('Play', '<Speed>1</Speed>'),
+        soap_request('GetTransportInfo'),
+        soap_request('GetPositionInfo'),
+        soap_request('Stop'),
+    ],
+}
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def cpu_seconds(process):
+    times = process.cpu_times()
+    return times.user + times.system
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_render(port):
+    # -> (render process, its temporary HOME)
+    home = tempfile.TemporaryDirectory(prefix='bench-render-')
+    env = dict(os.environ)
+    env['HOME'] = home.name
+    env['PATH'] = os.path.join(HERE, 'stub') + os.pathsep + env.get('PATH', '')
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    cmd = [sys.executable, '-c', 'from tiny_dlna.tiny_render import main; main()',
+           '--port', str(port), '--name', 'Bench Render']
+    render = subprocess.Popen(
+        cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if render.poll() is not None:
+            home.cleanup()
+            sys.exit(f'tiny-render exited with {render.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/description.xml')
+            if conn.getresponse().status == 200:
+                return render, home
+        except OSError:
+            pass
+        time.sleep(0.1)
+    render.kill()
+    render.wait()
+    home.cleanup()
+    sys.exit('tiny-render did not come up')
+
+
+def stop_render(render, home):
+    # a render leaves a playing mpv open, the stub one would stay
+    children = psutil.Process(render.pid).children(recursive=True)
+    render.send_signal(signal.SIGTERM)
+    try:
+        render.wait(5)
+    except subprocess.TimeoutExpired:
+        render.kill()
+        render.wait()
+    for child in children:
+        try:
+            child.kill()
+        except psutil.NoSuchProcess:
+            pass
+    home.cleanup()
+
+
+def soap_worker(port, requests, deadline, results):
+    latencies, statuses, errors = results
+    conn = None
+    i = 0
+    while time.monotonic() < deadline:
+        action, body, headers = requests[i % len(requests)]
+        i += 1
+        if conn is None:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        started_at = time.perf_counter()
+        try:
+            conn.request('POST', '/AVTransport/control', body, headers)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(action)
+            conn.close()
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - started_at)
+        statuses[response.status] += 1
+        if response.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+
+def bench_soap(render, port, scenario, concurrency, duration):
+    requests = SCENARIOS[scenario]
+    results = ([], collections.Counter(), [])
+    process = psutil.Process(render.pid)
+    cpu_before = cpu_seconds(process)
+    started_at = time.monotonic()
+    deadline = started_at + duration
+    workers = [
+        threading.Thread(target=soap_worker, args=(port, requests, deadline, results))
+        for _ in range(concurrency)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started_at
+    cpu = cpu_seconds(process) - cpu_before
+
+    latencies, statuses, errors = results
+    count = len(latencies)
+    failed = len(errors) + sum(n for status, n in statuses.items() if status != 200)
+    return {
+        'name': f'soap {scenario} x{concurrency}',
+        'count': count,
+        'rate': count / elapsed,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'cpu': cpu / count if count else float('nan'),
+        'failed': failed,
+    }
+
+
+def bench_ssdp(render, rate, duration, senders):
+    # unicast M-SEARCHes from `senders` sockets, round robin. The render
+    # drops a search repeated within DEDUP_WINDOW, so only the first
+    # search of a socket in each window is waited for an answer; the
+    # others still cost the render a parse and a lookup.
+    selector = selectors.DefaultSelector()
+    # socket -> (sent at, or None when nothing is awaited, last answerable send)
+    awaited = {}
+    for _ in range(senders):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        awaited[sock] = [None, -DEDUP_WINDOW]
+    socks = list(awaited)
+
+    latencies = []
+    sent = 0
+    answerable = 0
+    process = psutil.Process(render.pid)
+    cpu_before = cpu_seconds(process)
+    started_at = time.monotonic()
+    deadline = started_at + duration
+    # answers to the last searches may take a moment
+    drain_until = deadline + 1.0
+    interval = 1.0 / rate
+    next_send = started_at
+    while True:
+        now = time.monotonic()
+        if now >= drain_until:
+            break
+        while now < deadline and next_send <= now:
+            sock = socks[sent % senders]
+            next_send += interval
+            try:
+                sock.sendto(M_SEARCH, SSDP_ADDR)
+            except BlockingIOError:
+                continue
+            sent += 1
+            state = awaited[sock]
+            # a little margin, the render's clock started a bit later
+            if now - state[1] > DEDUP_WINDOW + 0.1:
+                state[0] = time.perf_counter()
+                state[1] = now
+                answerable += 1
+        wake_at = next_send if now < deadline else drain_until
+        for key, _ in selector.select(max(wake_at - time.monotonic(), 0)):
+            sock = key.fileobj
+            try:
+                sock.recvfrom(2048)
+            except OSError:
+                continue
+            state = awaited[sock]
+            if state[0] is not None:
+                latencies.append(time.perf_counter() - state[0])
+                state[0] = None
+    cpu = cpu_seconds(process) - cpu_before
+    for sock in socks:
+        sock.close()
+
+    return {
+        'name': f'ssdp {rate}/s x{senders}',
+        'count': sent,
+        'rate': sent / duration,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'cpu': cpu / sent if sent else float('nan'),
+        # not answered although not a repeat: the render's rate limit
+        'failed': answerable - len(latencies),
+    }
+
+
+def wait_for_ssdp(timeout=5):
+    # tiny-render opens its SSDP socket a little after HTTP is up
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(0.2)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            sock.sendto(M_SEARCH, SSDP_ADDR)
+            try:
+                sock.recvfrom(2048)
+                return True
+            except OSError:
+                continue
+    return False
+
+
+def print_row(result):
+    print(
+        f'{result["name"]:<24}{result["count"]:>9}{result["rate"]:>10.1f}'
+        f'{result["p50"] * 1e3:>10.2f}{result["p99"] * 1e3:>10.2f}'
+        f'{result["cpu"] * 1e6:>11.0f}{result["failed"]:>9}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench_render.py")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='SOAP scenario to run (repeatable, default: all)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='parallel SOAP clients (default: 8)')
+    parser.add_argument('--duration', type=float, default=5,
+                        help='seconds per run (default: 5)')
+    parser.add_argument('--ssdp-rate', type=int, default=1000,
+                        help='M-SEARCHes per second (default: 1000)')
+    parser.add_argument('--ssdp-senders', type=int, default=256,
+                        help='source sockets the M-SEARCHes come from (default: 256)')
+    parser.add_argument('--skip-soap', action='store_true')
+    parser.add_argument('--skip-ssdp', action='store_true')
+    args = parser.parse_args()
+
+    port = free_port()
+    render, home = start_render(port)
+    try:
+        print(f'{"run":<24}{"requests":>9}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}'
+              f'{"cpu us/req":>11}{"failed":>9}')
+        if not args.skip_soap:
+            for scenario in args.scenario or list(SCENARIOS):
+                print_row(bench_soap(render, port, scenario, args.concurrency, args.duration))
+        if not args.skip_ssdp:
+            if wait_for_ssdp():
+                print_row(bench_ssdp(render, args.ssdp_rate, args.duration, args.ssdp_senders))
+            else:
+                print('ssdp: no answer on 127.0.0.1:1900, is another SSDP server there?')
+    finally:
+        stop_render(render, home)
+
+
+if __name__ == '__main__':
+    main()
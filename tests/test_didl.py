@@ -0,0 +1,61 @@
+import html
+import unittest
+
+from tiny_dlna.tiny_didl import DIDLCache, parse_didl
+
+DIDL = (
+    '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    'xmlns:sec="http://www.sec.co.kr/">'
+    '<item id="1" parentID="0" restricted="1">{}</item></DIDL-Lite>'
+)
+
+
+class ParseDIDLTest(unittest.TestCase):
+    def test_samsung(self):
+        metadata = DIDL.format(
+            '<dc:title>bar.mp4</dc:title>'
+            '<sec:CaptionInfo sec:type="srt">http://h/b.srt</sec:CaptionInfo>'
+            '<sec:CaptionInfoEx sec:type="srt">http://h/a.srt</sec:CaptionInfoEx>'
+            '<res protocolInfo="http-get:*:video/mp4:*">http://h/bar.mp4</res>'
+            '<res protocolInfo="http-get:*:text/srt:*">http://h/c.srt</res>'
+        )
+        expected = {
+            'video': 'http://h/bar.mp4',
+            'title': 'bar.mp4',
+            # CaptionInfoEx is preferred wherever it is
+            'srt': 'http://h/a.srt',
+            'protocol_info': 'http-get:*:video/mp4:*',
+        }
+        self.assertEqual(parse_didl('', metadata), expected)
+        # CurrentURI wins over <res>, escaping twice is undone
+        result = parse_didl('http://h/uri.mp4', html.escape(metadata))
+        self.assertEqual(result, dict(expected, video='http://h/uri.mp4'))
+
+    def test_sloppy_metadata(self):
+        # bare `&` in a URL, an HTML entity and an undeclared prefix
+        metadata = DIDL.format(
+            '<dc:title>LOL&nbsp;MSI</dc:title><upnp:class>video</upnp:class>'
+            '<res protocolInfo="http-get:*:video/x-flv:*">http://h/1.flv?a=1&b=2</res>'
+        )
+        result = parse_didl('', metadata)
+        self.assertEqual(result['title'], 'LOL\xa0MSI')
+        self.assertEqual(result['video'], 'http://h/1.flv?a=1&b=2')
+
+    def test_broken_metadata(self):
+        self.assertEqual(parse_didl('http://h/v', '<dc:title>t</dc:title><oops')['title'], 't')
+        self.assertEqual(
+            parse_didl('http://h/v', ''),
+            {'video': 'http://h/v', 'title': '', 'srt': '', 'protocol_info': ''})
+
+    def test_cache_returns_copies(self):
+        cache = DIDLCache(size=1)
+        metadata = DIDL.format('<dc:title>t</dc:title>')
+        result = cache.parse('http://h/v', metadata)
+        result['title'] = 'changed'
+        self.assertEqual(cache.parse('http://h/v', metadata)['title'], 't')
+        self.assertEqual(cache.parse('http://h/w', metadata)['video'], 'http://h/w')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from unittest import mock
+
+from tiny_dlna.tiny_media import MediaHandler, parse_range, parse_time_seek_range
+
+
+class ParseRangeTest(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_range('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range('bytes=990-2000', 1000), [(990, 999)])
+
+    def test_overlapping_ranges_are_merged(self):
+        self.assertEqual(parse_range('bytes=0-10,5-20,22-30', 1000), [(0, 20), (22, 30)])
+
+    def test_unsatisfiable(self):
+        self.assertEqual(parse_range('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range('bytes=2000-', 1000), [])
+        self.assertEqual(parse_range('bytes=1000-1005', 1000), [])
+        self.assertEqual(parse_range('bytes=-0', 1000), [])
+        self.assertEqual(parse_range('bytes=0-', 0), [])
+
+    def test_malformed(self):
+        for value in ('bytes=10-5', 'items=0-1', 'bytes=abc', 'bytes=a-b'):
+            with self.assertRaises(ValueError):
+                parse_range(value, 1000)
+
+
+class TimeSeekTest(unittest.TestCase):
+    def test_parse_time_seek_range(self):
+        self.assertEqual(parse_time_seek_range('npt=10-'), (10.0, None))
+        self.assertEqual(parse_time_seek_range('npt=0:01:00.5-0:02:00'), (60.5, 120.0))
+        for value in ('npt=20-10', 'bytes=0-1', 'npt=-10'):
+            with self.assertRaises(ValueError):
+                parse_time_seek_range(value)
+
+    def get_time_seek(self, value, duration, size=1000):
+        handler = mock.Mock(headers={'TimeSeekRange.dlna.org': value})
+        with mock.patch('tiny_dlna.tiny_media.get_duration', return_value=duration):
+            return MediaHandler.get_time_seek(handler, '/x.mp4', size)
+
+    def test_time_seek_maps_to_bytes(self):
+        value, byte_range = self.get_time_seek('npt=25-', 100.0)
+        self.assertEqual(byte_range, (250, 999))
+        self.assertEqual(
+            value, 'npt=0:00:25.000-0:01:40.000/0:01:40.000 bytes=250-999/1000')
+        self.assertEqual(self.get_time_seek('npt=0-50', 100.0)[1], (0, 499))
+
+    def test_time_seek_not_possible(self):
+        # duration unknown, start past the end, broken header
+        self.assertIsNone(self.get_time_seek('npt=10-', None))
+        self.assertIsNone(self.get_time_seek('npt=100-', 100.0))
+        self.assertIsNone(self.get_time_seek('npt=x-', 100.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
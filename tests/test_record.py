@@ -0,0 +1,68 @@
+import datetime
+import itertools
+import os
+import tempfile
+import unittest
+
+from tiny_dlna.tiny_record import Recording, check_template, expand_template
+from tiny_dlna.tiny_record import get_free_path, safe_title
+
+NOW = datetime.datetime(2024, 5, 17, 20, 30, 5)
+
+
+class TemplateTest(unittest.TestCase):
+    def test_expand_template(self):
+        self.assertEqual(
+            expand_template('/rec/msi-%Y%m%d-{title}-{n:03}.mp4', 7, 'T1 vs GEN', NOW),
+            '/rec/msi-20240517-T1 vs GEN-007.mp4')
+        self.assertEqual(expand_template('/rec/a.mp4', 2, '', NOW), '/rec/a.mp4')
+
+    def test_safe_title(self):
+        self.assertEqual(safe_title('LOL/MSI: T1 vs GEN?'), 'LOL_MSI_ T1 vs GEN')
+        self.assertEqual(safe_title('..'), 'untitled')
+        self.assertEqual(safe_title(None), 'untitled')
+
+    def test_check_template(self):
+        self.assertIsNone(check_template('/rec/{n}-{title}.ts'))
+        self.assertIsNotNone(check_template('/rec/{x}.ts'))
+        self.assertIsNotNone(check_template('/rec/{n.ts'))
+
+
+class FilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def touch(self, name):
+        path = os.path.join(self.tmp.name, name)
+        open(path, 'w').close()
+        return path
+
+    def test_get_free_path(self):
+        path = os.path.join(self.tmp.name, 'a.mp4')
+        self.assertEqual(get_free_path(path), path)
+        self.touch('a.mp4')
+        self.touch('a-2.mp4')
+        self.assertEqual(get_free_path(path), os.path.join(self.tmp.name, 'a-3.mp4'))
+
+    def test_segments_are_numbered_on(self):
+        template = os.path.join(self.tmp.name, 'sub', 'seg-{n}.ts')
+        numbers = itertools.count(1)
+        first = Recording(template, numbers=numbers)
+        self.assertEqual(os.path.basename(first.next_path()), 'seg-1.ts')
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp.name, 'sub')))
+        second = Recording(template, numbers=numbers)
+        self.assertEqual(os.path.basename(second.next_path()), 'seg-2.ts')
+
+    def test_is_full(self):
+        recording = Recording(os.path.join(self.tmp.name, 'r.ts'), segment_size=10)
+        self.assertFalse(recording.is_full())
+        path = recording.next_path()
+        self.assertFalse(recording.is_full())
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 10)
+        self.assertTrue(recording.is_full())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import types
+import unittest
+
+from tiny_dlna.tiny_render import get_soap_action, parse_action_args
+
+ENVELOPE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<s:Body><u:SetAVTransportURI xmlns:u="urn:schemas-upnp-org:service:AVTransport:1">'
+    '<InstanceID>0</InstanceID><CurrentURI>http://h/v.mp4?a=1&amp;b=2</CurrentURI>'
+    '<CurrentURIMetaData>&lt;DIDL-Lite/&gt;</CurrentURIMetaData>'
+    '</u:SetAVTransportURI></s:Body></s:Envelope>'
+).encode('utf-8')
+
+
+def make_request(data=ENVELOPE, **headers):
+    return types.SimpleNamespace(data=data, headers=headers)
+
+
+class SOAPTest(unittest.TestCase):
+    def test_action_from_header(self):
+        request = make_request(
+            SOAPACTION='"urn:schemas-upnp-org:service:AVTransport:1#Play"')
+        self.assertEqual(get_soap_action(request), 'Play')
+
+    def test_action_from_body(self):
+        self.assertEqual(get_soap_action(make_request()), 'SetAVTransportURI')
+        self.assertEqual(get_soap_action(make_request(SOAPACTION='""')), 'SetAVTransportURI')
+        self.assertIsNone(get_soap_action(make_request(b'<broken')))
+
+    def test_action_args(self):
+        self.assertEqual(parse_action_args(ENVELOPE), {
+            'InstanceID': '0',
+            'CurrentURI': 'http://h/v.mp4?a=1&b=2',
+            'CurrentURIMetaData': '<DIDL-Lite/>',
+        })
+        self.assertIsNone(parse_action_args(b'<broken'))
+        self.assertIsNone(parse_action_args(b'<a/>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
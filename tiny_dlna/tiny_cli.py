@@ -1,8 +1,11 @@
 import argparse
+import concurrent.futures
+import http.client
 import json
 import logging
 import os.path
 import random
+import re
 import signal
 import socket
 import threading
@@ -11,10 +14,12 @@ import urllib.parse
 import urllib.request as urlreq
 import xml.etree.ElementTree as ET
 
-from flask import Flask, send_from_directory
 from xml.sax.saxutils import escape as xmlescape
-from urllib.error import URLError
-from .tiny_ssdp import SSDP_MULTICAST_IP, SSDP_PORT, get_host_ip
+from urllib.error import HTTPError, URLError
+from .tiny_media import start_media_server
+from .tiny_ssdp import SSDP_MULTICAST_IP, SSDP_PORT, get_config_file, get_local_ip
+from .tiny_ssdp import get_multicast_interfaces
+from .tiny_watch import get_watched_devices, run_watcher
 from .tiny_xmls import *  # NOQA
 
 logger = logging.getLogger('tiny_cli')
@@ -27,12 +32,27 @@ MSEARCH_MSG = (
     'ST: urn:schemas-upnp-org:service:AVTransport:1\r\n'
     '\r\n'
 )
+# UPnP 1.1: unicast searches have no MX, devices answer right away
+MSEARCH_UNICAST_MSG = MSEARCH_MSG.replace('MX: 1\r\n', '')
 DIR_LINKS = os.path.join('~', '.config', 'tiny-dlna', 'symlinks')
+# how long we wait for SSDP replies (MX plus some slack for the network)
+SSDP_WAIT = 1.2
+FETCH_TIMEOUT = 1.0
+FETCH_WORKERS = 32
+SOAP_TIMEOUT = 5.0
+# how long --sync waits for the renders to load the media
+READY_TIMEOUT = 15.0
+# states a render may report once SetAVTransportURI has been applied;
+# one still playing the previous item is stopped first
+READY_STATES = ('STOPPED', 'PAUSED_PLAYBACK')
+# how often --sync asks the renders if they started playing, i.e. how
+# exact the playing skew it reports is
+START_POLL_INTERVAL = 0.05
+# used when a device does not send `Cache-Control: max-age`
+DEFAULT_MAX_AGE = 1800
 
 
 def _get_device_info(location):
-    p = urllib.parse.urlparse(location)
-
     attrs = {}
     namespace = {'ns': 'urn:schemas-upnp-org:device-1-0'}
     namespaces = {
@@ -40,7 +60,7 @@ def _get_device_info(location):
         'dlna': 'urn:schemas-dlna-org:device-1-0'
     }
 
-    with urlreq.urlopen(location, timeout=1.0) as r:
+    with urlreq.urlopen(location, timeout=FETCH_TIMEOUT) as r:
         xml = r.read()
         root = ET.fromstring(xml.strip())
 
@@ -55,8 +75,9 @@ def _get_device_info(location):
         if elem is not None:
             control_url = elem.find('controlURL', namespaces).text
             if control_url:
-                control_url = control_url.lstrip('/')
-                attrs['control_url'] = f'http://{p.hostname}:{p.port}/{control_url}'
+                # relative to the description, e.g. virtual renders
+                # hosted under a path by one tiny-render
+                attrs['control_url'] = urllib.parse.urljoin(location, control_url)
 
     return attrs
 
@@ -81,62 +102,266 @@ def _parse_ssdp_response(resp):
             device['usn'] = v
         elif k == 'st':
             device['st'] = v
+        elif k == 'cache-control':
+            m = re.search(r'max-age\s*=\s*(\d+)', v, re.I)
+            if m:
+                device['max_age'] = int(m.group(1))
 
     if ':service:AVTransport:' not in device.get('st', ''):
         return None
 
-    attrs = _get_device_info(device['location'])
+    if 'location' not in device:
+        return None
+
+    return device
+
+
+def _fetch_device(device):
+    try:
+        attrs = _get_device_info(device['location'])
+    except (URLError, OSError, http.client.HTTPException, ValueError,
+            ET.ParseError, AttributeError) as e:
+        # render url does not respond, is not a valid url (ValueError),
+        # speaks broken HTTP or gives us a broken description
+        logger.debug(f'failed to fetch {device["location"]}: {e}')
+        return None
+
     device.update(attrs)
     return device
 
 
-def get_dlna_devices():
-    # Create the UDP socket
+def _match_device(device, query):
+    return query.lower() in device.get('friendly_name', '').lower()
+
+
+def _remembered_hosts(query):
+    # addresses of devices we have seen before, expired or not
+    hosts = set()
+    for device in _load_device_cache().values():
+        if _match_device(device, query):
+            host = urllib.parse.urlparse(device.get('location', '')).hostname
+            if host:
+                hosts.add(host)
+    return hosts
+
+
+def _get_watched_devices(query=None):
+    # devices known to a running `tiny-cli watch`, None when there is no
+    # watcher or it does not know any device matching `query`
+    devices = get_watched_devices()
+    if devices is None:
+        return None
+    if query and not any(_match_device(d, query) for d in devices):
+        return None
+    logger.debug(f'got {len(devices)} devices from the watcher')
+    return devices
+
+
+def get_dlna_devices(query=None):
+    devices = _get_watched_devices(query)
+    if devices is not None:
+        return devices
+
+    # with `query`, return as soon as a device matching it is resolved
+    # instead of waiting for the whole MX window
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
-    sock.settimeout(1.2)
 
-    # Send the M-SEARCH message to the SSDP multicast address
+    # Send the M-SEARCH message to the SSDP multicast address, out of
+    # every interface, as devices may sit on any of them
     # logger.debug("Sending M-SEARCH...")
-    sock.sendto(MSEARCH_MSG.encode('utf-8'), (SSDP_MULTICAST_IP, SSDP_PORT))
-
-    devices = []
-    known_locations = set()
-    while True:
+    msg = MSEARCH_MSG.encode('utf-8')
+    ifaces = get_multicast_interfaces().values()
+    if not ifaces:
+        sock.sendto(msg, (SSDP_MULTICAST_IP, SSDP_PORT))
+    for iface in ifaces:
         try:
-            data, addr = sock.recvfrom(1024)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                            socket.inet_aton(iface.ip))
+            sock.sendto(msg, (SSDP_MULTICAST_IP, SSDP_PORT))
+        except OSError as e:
+            logger.debug(f'failed to search on {iface.name}: {e}')
+    if query:
+        # the device most likely still lives where we saw it last time,
+        # a unicast search is answered without any MX delay
+        for host in _remembered_hosts(query):
             try:
-                device = _parse_ssdp_response(data.decode('utf-8'))
-            except URLError:
-                # render url does not respond
+                sock.sendto(MSEARCH_UNICAST_MSG.encode('utf-8'), (host, SSDP_PORT))
+            except OSError:
+                pass
+
+    found = threading.Event()
+
+    def _on_fetched(future):
+        if future.cancelled() or not query:
+            return
+        device = future.result()
+        if device and _match_device(device, query):
+            found.set()
+
+    # description.xml fetches run in the pool, so a slow device never
+    # keeps us from reading the other SSDP replies
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+    futures = []
+    known_locations = set()
+    deadline = time.monotonic() + SSDP_WAIT
+    try:
+        while not found.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            # wake up now and then to see if the wanted device is resolved
+            sock.settimeout(min(remaining, 0.02) if query else remaining)
+            try:
+                data, addr = sock.recvfrom(1024)
+            except socket.timeout:
                 continue
 
-            location = device.get('location')
+            device = _parse_ssdp_response(data.decode('utf-8', 'replace'))
+            if not device:
+                continue
+
+            location = device['location']
             # logger.debug(f'got reply from {addr}, Location: {location}')
-            if device and location not in known_locations:
-                devices.append(device)
-                known_locations.add(location)
-        except socket.timeout:
-            break
+            if location in known_locations:
+                continue
+            known_locations.add(location)
+            future = pool.submit(_fetch_device, device)
+            future.add_done_callback(_on_fetched)
+            futures.append(future)
+
+        # fetches started late in the window get one more fetch timeout
+        deadline = time.monotonic() + FETCH_TIMEOUT
+        pending = set(futures)
+        while pending and not found.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            _, pending = concurrent.futures.wait(
+                pending, timeout=remaining,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+    finally:
+        sock.close()
+        pool.shutdown(wait=False, cancel_futures=True)
 
+    devices = []
+    for future in futures:
+        if future.done() and not future.cancelled() and future.result():
+            devices.append(future.result())
+
+    _save_device_cache(devices)
     return devices
 
 
+def _load_device_cache():
+    config_file = get_config_file('devices-cache.json')
+    if not os.path.exists(config_file):
+        return {}
+
+    try:
+        with open(config_file) as f:
+            return json.load(f).get('devices', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_device_cache(cache):
+    config_file = get_config_file('devices-cache.json')
+    # several tiny-cli may run at the same time, never leave half a file
+    tmp_file = f'{config_file}.{os.getpid()}'
+    with open(tmp_file, 'w') as f:
+        json.dump({'devices': cache}, f, ensure_ascii=False, sort_keys=True, indent=4)
+    os.replace(tmp_file, config_file)
+
+
+def _save_device_cache(devices):
+    cache = _load_device_cache()
+    now = time.time()
+    for device in devices:
+        if not device.get('usn') or not device.get('control_url'):
+            continue
+        entry = dict(device)
+        entry['expires_at'] = now + device.get('max_age', DEFAULT_MAX_AGE)
+        cache[device['usn']] = entry
+
+    try:
+        _write_device_cache(cache)
+    except OSError as e:
+        logger.debug(f'failed to save device cache: {e}')
+
+
+def _find_cached_device(query):
+    now = time.time()
+    for device in _load_device_cache().values():
+        if device.get('expires_at', 0) < now:
+            continue
+        if _match_device(device, query):
+            return device
+    return None
+
+
+def _forget_if_gone(url_control):
+    # drop the cached device behind `url_control` if it does not answer
+    # any more; True means the caller should discover it again
+    cache = _load_device_cache()
+    for usn, device in cache.items():
+        if device.get('control_url') == url_control:
+            break
+    else:
+        return False
+
+    try:
+        with urlreq.urlopen(device['location'], timeout=FETCH_TIMEOUT):
+            pass
+        return False
+    except HTTPError:
+        # it answers, the command failed for some other reason
+        return False
+    except (URLError, OSError):
+        pass
+
+    logger.debug(f'cached device is gone: {device["location"]}')
+    del cache[usn]
+    try:
+        _write_device_cache(cache)
+    except OSError as e:
+        logger.debug(f'failed to save device cache: {e}')
+    return True
+
+
 def list_dlna_devices():
     devices = get_dlna_devices()
     print(json.dumps({'devices': devices}, ensure_ascii=False, sort_keys=True, indent=2))
 
 
+def watch_dlna_devices():
+    run_watcher(_fetch_device)
+
+
 def stop_dlna_render(args):
-    url_control, names = get_control_url(args)
-    if not url_control:
+    urls_control, names = get_control_urls(args)
+    if not urls_control:
         logger.error(f'No such device found: {args.query}')
         logger.error('Available names: {}'.format(', '.join(names)))
         exit(1)
 
+    if len(urls_control) > 1:
+        logger.debug(f'Stopping streaming on DLNA: {urls_control}')
+        run_parallel(
+            lambda url: send_dlna_command(url, XML_STOP, 'Stop'),
+            urls_control,
+        )
+        return
+
+    url_control = urls_control[0]
     logger.debug(f'Stopping streaming on DLNA: {url_control}')
-    send_dlna_command(url_control, XML_STOP, 'Stop')
+    send_with_rediscovery(
+        args, url_control,
+        lambda url: send_dlna_command(url, XML_STOP, 'Stop'),
+    )
 
 
 def seek_dlna_render(args):
@@ -148,51 +373,41 @@ def seek_dlna_render(args):
 
     logger.debug(f'Seek streaming to {args.to}: {url_control}')
     xml = XML_SEEK_PTN.format(args.to)
-    send_dlna_command(url_control, xml, 'Seek')
+    send_with_rediscovery(
+        args, url_control,
+        lambda url: send_dlna_command(url, xml, 'Seek'),
+    )
 
 
 def post(url, action_data, headers):
     action_data = action_data.encode("utf-8")
     r = urlreq.Request(url, action_data, headers)
     try:
-        urlreq.urlopen(r)
+        with urlreq.urlopen(r, timeout=SOAP_TIMEOUT) as resp:
+            body = resp.read()
     except Exception as e:
         logger.error('{}: {}'.format(e.__class__.__name__, e))
+        return None
     logging.debug("Request sent")
+    return body
 
 
-app = Flask(__name__)
-
-
-@app.route('/videos/<name_video>')
-def serve_video(name_video):
-    dir_base = os.path.expanduser(DIR_LINKS)
-    # Ensure proper MIME type for subtitle files
-    if name_video.endswith('.srt'):
-        return send_from_directory(dir_base, name_video, mimetype='text/srt')
-    return send_from_directory(dir_base, name_video)
-
-
-def run_flask_server(port):
-    app.run(host='0.0.0.0', port=port)
-
-
-def send_dlna_command(url_control, action_body, action_name):
+def _soap_headers(action_name):
     st = "urn:schemas-upnp-org:service:AVTransport:1"
-    headers = {
+    return {
         'Content-Type': 'text/xml; charset="utf-8"',
         'SOAPACTION': f'"{st}#{action_name}"',
         "Connection": "close",
     }
-    post(url_control, action_body, headers)
+
+
+def send_dlna_command(url_control, action_body, action_name):
+    return post(url_control, action_body, _soap_headers(action_name))
 
 
 def send_set_av_transport(url_control, url_video, url_srt=None, title=None):
     url_video = url_video.replace('&', '&amp;')
-    if 'http://192.168' in url_video:
-        title = title or urllib.parse.unquote(url_video.split('/')[-1])
-    else:
-        title = title or 'online stream'
+    title = title or 'online stream'
 
     subtitle = ''
     if url_srt:
@@ -207,14 +422,105 @@ def send_set_av_transport(url_control, url_video, url_srt=None, title=None):
         url_video=url_video,
         metadata=xmlescape(metadata),
     )
-    send_dlna_command(url_control, xml, 'SetAVTransportURI')
+    return send_dlna_command(url_control, xml, 'SetAVTransportURI')
 
 
 def send_play(url_control):
-    send_dlna_command(url_control, XML_PLAY, 'Play')
+    return send_dlna_command(url_control, XML_PLAY, 'Play')
 
 
-def send_stop(url_control):
+def get_transport_state(url_control):
+    body = send_dlna_command(url_control, XML_GET_TRANSINFO, 'GetTransportInfo')
+    if body is None:
+        return None
+
+    try:
+        root = ET.fromstring(body.strip())
+    except ET.ParseError:
+        return None
+    elem = root.find('.//CurrentTransportState')
+    return elem.text if elem is not None else None
+
+
+def wait_until_ready(url_control, timeout=READY_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state = get_transport_state(url_control)
+        logger.debug(f'{url_control}: {state}')
+        if state in READY_STATES:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def wait_until_playing(url_control, timeout=READY_TIMEOUT):
+    # when the render first said PLAYING, None if it never did
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if get_transport_state(url_control) == 'PLAYING':
+            return time.monotonic()
+        time.sleep(START_POLL_INTERVAL)
+    return None
+
+
+def sync_play(urls_control):
+    # the connections are opened up front, so once the barrier is
+    # released each thread only has to write one request
+    barrier = threading.Barrier(len(urls_control))
+    body = XML_PLAY.encode('utf-8')
+    headers = _soap_headers('Play')
+
+    def _play(url_control):
+        p = urllib.parse.urlparse(url_control)
+        conn = http.client.HTTPConnection(p.hostname, p.port, timeout=SOAP_TIMEOUT)
+        try:
+            conn.connect()
+        except OSError as e:
+            logger.error(f'{url_control}: {e}')
+            conn = None
+
+        barrier.wait()
+        if conn is None:
+            return None
+        try:
+            sent_at = time.monotonic()
+            conn.request('POST', p.path, body, headers)
+            resp = conn.getresponse()
+            resp.read()
+            acked_at = time.monotonic()
+        except (OSError, http.client.HTTPException) as e:
+            logger.error(f'{url_control}: {e}')
+            return None
+        finally:
+            conn.close()
+        return sent_at, acked_at, resp.status, wait_until_playing(url_control)
+
+    return run_parallel(_play, urls_control)
+
+
+def report_skew(urls_control, results):
+    # ack skew: when each render answered Play. Playing skew: when it
+    # first reported PLAYING, only as exact as START_POLL_INTERVAL
+    acked = [r[1] for r in results if r]
+    first_acked = min(acked) if acked else 0
+    started = [r[3] for r in results if r and r[3]]
+    first_started = min(started) if started else 0
+    for url_control, r in zip(urls_control, results):
+        if not r:
+            print(f'{url_control}: failed')
+            continue
+        sent_at, acked_at, status, started_at = r
+        rtt = (acked_at - sent_at) * 1000
+        ack_skew = (acked_at - first_acked) * 1000
+        if started_at:
+            playing = f'playing skew +{(started_at - first_started) * 1000:.0f} ms'
+        else:
+            playing = 'not playing'
+        print(f'{url_control}: HTTP {status}, rtt {rtt:.1f} ms, '
+              f'ack skew +{ack_skew:.1f} ms, {playing}')
+
+
+def remove_links():
     dir_links = os.path.expanduser(DIR_LINKS)
     if not os.path.isdir(dir_links):
         return
@@ -224,7 +530,32 @@ def send_stop(url_control):
         if os.path.islink(item_path):
             os.unlink(item_path)
 
-    send_dlna_command(url_control, XML_STOP, 'Stop')
+
+def send_stop(url_control):
+    remove_links()
+    return send_dlna_command(url_control, XML_STOP, 'Stop')
+
+
+def run_parallel(func, urls_control):
+    # one thread per render, so N renders cost about one round-trip
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(urls_control)) as pool:
+        return list(pool.map(func, urls_control))
+
+
+def send_with_rediscovery(args, url_control, send):
+    # `url_control` may come from the device cache; when the device has
+    # moved or gone away, find it again and retry once.
+    if send(url_control) is not None:
+        return url_control
+
+    if not _forget_if_gone(url_control):
+        return url_control
+
+    url_new, _ = get_control_url(args)
+    if url_new:
+        send(url_new)
+        return url_new
+    return url_control
 
 
 def create_link(path_file):
@@ -243,11 +574,19 @@ def create_link(path_file):
 
 
 def get_control_url(args):
-    devices = get_dlna_devices()
+    # a watcher knows what is alive right now, the cache only what was
+    devices = _get_watched_devices(args.query)
+    if devices is None:
+        device = _find_cached_device(args.query)
+        if device:
+            logger.debug(f'using cached device: {device["location"]}')
+            return device['control_url'], []
+        devices = get_dlna_devices(query=args.query)
+
     url = None
     other_names = []
     for d in devices:
-        if args.query.lower() in d['friendly_name'].lower():
+        if _match_device(d, args.query):
             url = d.get('control_url')
         else:
             other_names.append(d.get('friendly_name', 'no-name'))
@@ -255,69 +594,142 @@ def get_control_url(args):
     return url, other_names
 
 
-def play_online_stream(url_control, url_stream, title=None):
-    send_set_av_transport(url_control, url_stream, title=title)
-    send_play(url_control)
+def get_control_urls(args):
+    # with `--all`, every device matching the query, not just the first
+    if not getattr(args, 'all', False):
+        url, other_names = get_control_url(args)
+        return ([url] if url else []), other_names
+
+    urls = []
+    other_names = []
+    for d in get_dlna_devices():
+        if _match_device(d, args.query) and d.get('control_url'):
+            urls.append(d['control_url'])
+        else:
+            other_names.append(d.get('friendly_name', 'no-name'))
+
+    return urls, other_names
+
+
+def send_media(url_control, get_media):
+    # `get_media(url_control)` gives (url_video, url_srt, title) for one
+    # render, as renders on different networks reach us at different IPs
+    url_video, url_srt, title = get_media(url_control)
+    return send_set_av_transport(url_control, url_video, url_srt, title=title)
+
+
+def start_playing(args, urls_control, get_media):
+    if getattr(args, 'sync', False):
+        return start_playing_synced(args, urls_control, get_media)
 
+    if len(urls_control) == 1:
+        url_control = send_with_rediscovery(
+            args, urls_control[0],
+            lambda url: send_media(url, get_media),
+        )
+        send_play(url_control)
+        return [url_control]
+
+    def _start(url_control):
+        if send_media(url_control, get_media) is None:
+            return None
+        return send_play(url_control)
+
+    logger.debug(f'playing on {len(urls_control)} renders: {urls_control}')
+    run_parallel(_start, urls_control)
+    return urls_control
+
+
+def start_playing_synced(args, urls_control, get_media):
+    def _prepare(url_control):
+        if get_transport_state(url_control) in ('PLAYING', 'PAUSED_PLAYBACK', 'TRANSITIONING'):
+            # or it would look ready before it took our media
+            send_dlna_command(url_control, XML_STOP, 'Stop')
+        if send_media(url_control, get_media) is None:
+            return False
+        return wait_until_ready(url_control)
+
+    ready = run_parallel(_prepare, urls_control)
+    for url_control, ok in zip(urls_control, ready):
+        if not ok:
+            logger.error(f'render not ready, leaving it out: {url_control}')
+    urls_ready = [url for url, ok in zip(urls_control, ready) if ok]
+    if not urls_ready:
+        return urls_control
+
+    results = sync_play(urls_ready)
+    report_skew(urls_ready, results)
+    return urls_control
+
+
+def stop_playing(urls_control):
+    remove_links()
+    run_parallel(
+        lambda url: send_dlna_command(url, XML_STOP, 'Stop'),
+        urls_control,
+    )
+
+
+def wait_and_stop(urls_control):
     def signal_handler(sig, frame):
-        send_stop(url_control)
+        stop_playing(urls_control)
         exit(0)
     signal.signal(signal.SIGINT, signal_handler)
 
+    # Keep main thread running so the server stays up and we can catch signal
     while True:
         time.sleep(1)
 
 
+def play_online_stream(args, urls_control, url_stream):
+    urls_control = start_playing(
+        args, urls_control, lambda url: (url_stream, None, args.title))
+    wait_and_stop(urls_control)
+
+
 def play_video(args):
     path_video = args.video_file
-    url_control, names = get_control_url(args)
-    if not url_control:
+    urls_control, names = get_control_urls(args)
+    if not urls_control:
         logger.error(f'no such DLNA device found: {args.query}')
         logger.error('Available names: {}'.format(', '.join(names)))
         exit(0)
 
     if path_video.startswith('http://') or path_video.startswith('https://'):
-        return play_online_stream(url_control, path_video, title=args.title)
+        return play_online_stream(args, urls_control, path_video)
 
     if not os.path.isfile(path_video):
         print(f'no such file: {path_video}')
         exit(0)
 
-    ip = get_host_ip()
     port = random.randint(50000, 58999)
 
     logger.info(f'play video: {path_video}')
     create_link(path_video)
     name_video = os.path.basename(path_video)
-    url_video = f"http://{ip}:{port}/videos/{urllib.parse.quote(name_video)}"
 
     path_srt = '.'.join(path_video.split('.')[:-1]) + '.srt'
     if os.path.exists(path_srt):
         create_link(path_srt)
         name_srt = os.path.basename(path_srt)
-        url_srt = f"http://{ip}:{port}/videos/{urllib.parse.quote(name_srt)}"
     else:
-        path_srt = None
-        url_srt = None
+        name_srt = None
 
-    server_thread = threading.Thread(target=run_flask_server, args=(port,))
-    server_thread.daemon = True
-    server_thread.start()
+    def get_media(url_control):
+        # our address on the network of this render
+        ip = get_local_ip(urllib.parse.urlparse(url_control).hostname)
+        url_video = f"http://{ip}:{port}/videos/{urllib.parse.quote(name_video)}"
+        url_srt = None
+        if name_srt:
+            url_srt = f"http://{ip}:{port}/videos/{urllib.parse.quote(name_srt)}"
+        return url_video, url_srt, args.title or name_video
 
-    # Give some time for the server to start
-    time.sleep(1.6)
+    start_media_server(os.path.expanduser(DIR_LINKS), port)
 
-    send_set_av_transport(url_control, url_video, url_srt, title=args.title)
-    send_play(url_control)
-
-    def signal_handler(sig, frame):
-        send_stop(url_control)
-        exit(0)
-    signal.signal(signal.SIGINT, signal_handler)
-
-    # Keep main thread running so the server stays up and we can catch signal
-    while True:
-        time.sleep(1)
+    # all renders share this one server, i.e. one read path and one page
+    # cache for the file
+    urls_control = start_playing(args, urls_control, get_media)
+    wait_and_stop(urls_control)
 
 
 def main():
@@ -340,11 +752,19 @@ def main():
     list_parser.add_argument('-v', dest='verbose', action='store_true',
                               help='Enable verbose logs')
 
+    watch_parser = subparsers.add_parser(
+        'watch', help='Keep track of DLNA devices in the background, so that '
+                      'other commands find them instantly')
+    watch_parser.add_argument('-v', dest='verbose', action='store_true',
+                              help='Enable verbose logs')
+
     stop_parser = subparsers.add_parser('stop', help='Stop DLNA streaming')
     stop_parser.add_argument('-v', dest='verbose', action='store_true',
                               help='Enable verbose logs')
     stop_parser.add_argument('-q', dest='query', type=str, required=True,
                              help='Specify Device by Friendly Name')
+    stop_parser.add_argument('--all', dest='all', action='store_true',
+                             help='Stop all devices matching the name')
 
     seek_parser = subparsers.add_parser('seek', help='Seek DLNA streaming')
     seek_parser.add_argument('-v', dest='verbose', action='store_true',
@@ -362,20 +782,33 @@ def main():
                              help='Specify Device by Friendly Name')
     play_parser.add_argument('--title', dest='title', type=str, default=None,
                              help='Override the title')
+    play_parser.add_argument('--all', dest='all', action='store_true',
+                             help='Play on all devices matching the name')
+    play_parser.add_argument('--sync', dest='sync', action='store_true',
+                             help='Wait for all devices to be ready, then '
+                                  'start them at the same time')
 
     args = parser.parse_args()
     if args.verbose:
         logger.setLevel(logging.DEBUG)
+    else:
+        logging.getLogger('tiny_ssdp').setLevel(logging.ERROR)
 
     if args.command == 'list':
         list_dlna_devices()
+    elif args.command == 'watch':
+        if args.verbose:
+            logging.getLogger('tiny_watch').setLevel(logging.DEBUG)
+        else:
+            logging.getLogger('tiny_watch').setLevel(logging.INFO)
+        watch_dlna_devices()
     elif args.command == 'stop':
         stop_dlna_render(args)
     elif args.command == 'seek':
         seek_dlna_render(args)
     elif args.command == 'play':
-        if not args.verbose:
-            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        if args.verbose:
+            logging.getLogger('tiny_media').setLevel(logging.DEBUG)
         play_video(args)
 
 
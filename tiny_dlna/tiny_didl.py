@@ -0,0 +1,194 @@
+import collections
+import hashlib
+import html
+import logging
+import re
+import threading
+
+from xml.parsers import expat
+
+logger = logging.getLogger('tiny_didl')
+
+# DIDL-Lite beyond this is not looked at; what we need comes first, the
+# bulk of big payloads is album art and descriptions
+MAX_METADATA_SIZE = 256 * 1024
+# text kept per field, a title or URL is never longer
+MAX_FIELD_SIZE = 8 * 1024
+CHUNK_SIZE = 16 * 1024
+# parsed SetAVTransportURI payloads kept around for controllers resending
+# the same one (retries, reconnects, playlist reshuffles)
+CACHE_SIZE = 32
+
+# `&` not starting an entity or character reference, as sent by apps
+# that do not escape their URLs
+_BARE_AMP = re.compile(r'&(?!(?:[A-Za-z][A-Za-z0-9]*|#[0-9]+|#x[0-9A-Fa-f]+);)')
+_TITLE_RE = re.compile(r'<(?:\w+:)?title>(.*?)</(?:\w+:)?title>', re.DOTALL)
+
+# subtitle sources by preference: Samsung, then Panasonic, then a <res>
+SUBTITLE_FIELDS = ('CaptionInfoEx', 'CaptionInfo', 'subtitleFileUri', 'subtitle_res')
+
+
+def _local_name(name):
+    # prefixes are matched loosely: senders use `sec:` and friends
+    # without declaring them
+    return name.rsplit(':', 1)[-1]
+
+
+def _is_subtitle_res(attrs):
+    return (attrs.get('type') == 'text/subtitle'
+            or 'text/srt' in attrs.get('protocolInfo', ''))
+
+
+class DIDLParser:
+    # one pass of expat over the DIDL-Lite of the first <item>, only the
+    # text of the fields we want is collected
+    def __init__(self):
+        self.fields = {}
+        self.protocol_info = ''
+        self.field = None
+        self.text = []
+        self.text_size = 0
+        self.in_item = False
+        self.done = False
+
+        self.parser = expat.ParserCreate()
+        # undefined entities like &nbsp; are passed to us instead of
+        # failing the parse
+        self.parser.UseForeignDTD(True)
+        self.parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.data
+        self.parser.SkippedEntityHandler = self.skipped_entity
+        self.parser.buffer_text = True
+
+    def start(self, name, attrs):
+        name = _local_name(name)
+        if name == 'item' and not self.done:
+            self.in_item = True
+            return
+        if not self.in_item or self.field:
+            return
+
+        if name == 'res':
+            if _is_subtitle_res(attrs):
+                self.begin('subtitle_res')
+            elif not self.protocol_info:
+                self.protocol_info = attrs.get('protocolInfo', '')
+                self.begin('res')
+        elif name in ('title', 'CaptionInfoEx', 'CaptionInfo', 'subtitleFileUri'):
+            self.begin(name)
+
+    def begin(self, field):
+        if field in self.fields:
+            # the first one wins
+            return
+        self.field = field
+        self.text = []
+        self.text_size = 0
+
+    def end(self, name):
+        name = _local_name(name)
+        if name == 'item' and self.in_item:
+            self.in_item = False
+            self.done = True
+        elif self.field and (name == self.field or name == 'res'):
+            self.fields[self.field] = ''.join(self.text).strip()
+            self.field = None
+
+    def data(self, text):
+        if self.field and self.text_size < MAX_FIELD_SIZE:
+            self.text.append(text)
+            self.text_size += len(text)
+
+    def skipped_entity(self, name, is_parameter_entity):
+        self.data(html.unescape(f'&{name};'))
+
+    def feed(self, metadata, truncated=False):
+        # stops at the end of the first item; a `truncated` document is
+        # not expected to be complete
+        for pos in range(0, len(metadata), CHUNK_SIZE):
+            self.parser.Parse(metadata[pos:pos + CHUNK_SIZE], False)
+            if self.done:
+                return
+        if truncated:
+            logger.debug(f'metadata cut at {MAX_METADATA_SIZE} chars')
+        else:
+            self.parser.Parse('', True)
+
+
+def parse_didl(current_uri, metadata):
+    # {'video', 'title', 'srt', 'protocol_info'} from a CurrentURI and
+    # its CurrentURIMetaData, whatever shape the sender got it in
+    result = {'video': current_uri, 'title': '', 'srt': '', 'protocol_info': ''}
+    if not metadata:
+        logger.debug('no metadata')
+        return result
+
+    metadata = metadata.strip()
+    if metadata.startswith('&lt;'):
+        # escaped twice by the sender
+        metadata = html.unescape(metadata[:MAX_METADATA_SIZE * 2])
+    truncated = len(metadata) > MAX_METADATA_SIZE
+    metadata = metadata[:MAX_METADATA_SIZE]
+    if '&' in metadata:
+        metadata = _BARE_AMP.sub('&amp;', metadata)
+
+    didl = DIDLParser()
+    try:
+        didl.feed(metadata, truncated)
+    except expat.ExpatError as e:
+        # keep what we got up to the error (e.g. Huya)
+        logger.debug(f'broken metadata: {e}')
+
+    fields = didl.fields
+    result['title'] = fields.get('title', '')
+    if not result['title']:
+        m = _TITLE_RE.search(metadata)
+        if m:
+            result['title'] = html.unescape(m.group(1)).strip()
+    for name in SUBTITLE_FIELDS:
+        if fields.get(name):
+            result['srt'] = fields[name]
+            break
+    result['protocol_info'] = didl.protocol_info
+    if not result['video']:
+        result['video'] = fields.get('res', '')
+    return result
+
+
+class DIDLCache:
+    # LRU of parse_didl() results keyed by a digest of its input, so
+    # neither big payloads nor their parsed copies pile up in memory
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def get_key(self, current_uri, metadata):
+        # parse_didl() looks no further than this into the metadata, so
+        # neither does the key; its length tells if it was cut
+        metadata = (metadata or '').strip()
+        h = hashlib.sha1(current_uri.encode('utf-8', 'surrogatepass'))
+        h.update(f'\0{len(metadata)}\0'.encode('ascii'))
+        h.update(metadata[:MAX_METADATA_SIZE * 2].encode('utf-8', 'surrogatepass'))
+        return h.digest()
+
+    def parse(self, current_uri, metadata):
+        key = self.get_key(current_uri, metadata)
+
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+                return dict(result)
+
+        result = parse_didl(current_uri, metadata)
+        with self.lock:
+            self.entries[key] = result
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return dict(result)
+
+
+didl_cache = DIDLCache()
@@ -0,0 +1,185 @@
+import http.client
+import logging
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+from xml.sax.saxutils import escape as xmlescape, quoteattr
+
+logger = logging.getLogger('tiny_events')
+
+TIMEOUT_DEFAULT = 1800
+TIMEOUT_MAX = 3600
+# UPnP AV asks for LastChange to be moderated to at most 5 events/s,
+# everything changing within this window goes out as one NOTIFY
+MODERATION_INTERVAL = 0.2
+NOTIFY_TIMEOUT = 2.0
+
+AVT_EVENT_NS = 'urn:schemas-upnp-org:metadata-1-0/AVT/'
+RCS_EVENT_NS = 'urn:schemas-upnp-org:metadata-1-0/RCS/'
+
+
+def build_last_change(namespace, variables):
+    # `variables` maps a state variable name to its value, or to a list
+    # of (attrs, value) for variables like Volume having a channel
+    items = []
+    for name, value in variables.items():
+        if isinstance(value, list):
+            for attrs, v in value:
+                extra = ''.join(f' {k}={quoteattr(a)}' for k, a in attrs.items())
+                items.append(f'<{name}{extra} val={quoteattr(str(v))}/>')
+        else:
+            items.append(f'<{name} val={quoteattr(str(value))}/>')
+
+    return (
+        f'<Event xmlns="{namespace}"><InstanceID val="0">'
+        + ''.join(items)
+        + '</InstanceID></Event>'
+    )
+
+
+def build_property_set(properties):
+    body = ''.join(
+        f'<e:property><{k}>{xmlescape(str(v))}</{k}></e:property>'
+        for k, v in properties.items()
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">'
+        f'{body}</e:propertyset>'
+    ).encode('utf-8')
+
+
+def parse_timeout(value):
+    m = re.match(r'\s*Second-(\d+)', value or '', re.I)
+    if not m:
+        return TIMEOUT_DEFAULT
+    return min(max(int(m.group(1)), 60), TIMEOUT_MAX)
+
+
+def parse_callbacks(value):
+    return [
+        url for url in re.findall(r'<([^>]+)>', value or '')
+        if url.startswith('http://')
+    ]
+
+
+class Subscription:
+    def __init__(self, callbacks, timeout):
+        self.sid = f'uuid:{uuid.uuid4()}'
+        self.callbacks = callbacks
+        self.seq = 0
+        self.initial = True
+        self.renew(timeout)
+
+    def renew(self, timeout):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def next_seq(self):
+        seq = self.seq
+        # wraps to 1, 0 is only for the initial event
+        self.seq = seq + 1 if seq < 0xffffffff else 1
+        return seq
+
+
+class EventService(threading.Thread):
+    # GENA subscriptions of one service, and the thread delivering its
+    # NOTIFYs; `get_properties(changes)` returns the evented properties
+    # for a set of changes, or all of them when `changes` is None
+    def __init__(self, name, get_properties):
+        super().__init__(daemon=True)
+        self.name = name
+        self.get_properties = get_properties
+        self.cond = threading.Condition()
+        self.subscriptions = {}
+        self.pending = {}
+
+    def subscribe(self, callbacks, timeout):
+        sub = Subscription(callbacks, timeout)
+        with self.cond:
+            self.subscriptions[sub.sid] = sub
+            self.cond.notify()
+        logger.debug(f'{self.name}: new subscription {sub.sid} {callbacks}')
+        return sub
+
+    def renew(self, sid, timeout):
+        with self.cond:
+            sub = self.subscriptions.get(sid)
+            if sub is None or sub.expires_at < time.monotonic():
+                return None
+            sub.renew(timeout)
+            return sub
+
+    def unsubscribe(self, sid):
+        with self.cond:
+            return self.subscriptions.pop(sid, None) is not None
+
+    def notify_changes(self, changes):
+        with self.cond:
+            if not self.subscriptions:
+                return
+            self.pending.update(changes)
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.has_initial():
+                    self.cond.wait()
+
+            # let a burst of changes pile up into one event
+            time.sleep(MODERATION_INTERVAL)
+
+            with self.cond:
+                changes, self.pending = self.pending, {}
+                now = time.monotonic()
+                for sid, sub in list(self.subscriptions.items()):
+                    if sub.expires_at < now:
+                        logger.debug(f'{self.name}: subscription expired {sid}')
+                        del self.subscriptions[sid]
+                subs = list(self.subscriptions.values())
+                initial = [s for s in subs if s.initial]
+                for sub in initial:
+                    sub.initial = False
+
+            if initial:
+                body = build_property_set(self.get_properties(None))
+                for sub in initial:
+                    self.send(sub, body)
+
+            others = [s for s in subs if s not in initial]
+            if changes and others:
+                properties = self.get_properties(changes)
+                if properties:
+                    body = build_property_set(properties)
+                    for sub in others:
+                        self.send(sub, body)
+
+    def has_initial(self):
+        return any(s.initial for s in self.subscriptions.values())
+
+    def send(self, sub, body):
+        seq = sub.next_seq()
+        for url in sub.callbacks:
+            p = urllib.parse.urlparse(url)
+            headers = {
+                'HOST': p.netloc,
+                'CONTENT-TYPE': 'text/xml; charset="utf-8"',
+                'NT': 'upnp:event',
+                'NTS': 'upnp:propchange',
+                'SID': sub.sid,
+                'SEQ': str(seq),
+            }
+            conn = http.client.HTTPConnection(p.hostname, p.port or 80, timeout=NOTIFY_TIMEOUT)
+            try:
+                conn.request('NOTIFY', p.path or '/', body, headers)
+                conn.getresponse().read()
+                # the first callback that accepts it is enough
+                return
+            except (OSError, http.client.HTTPException) as e:
+                logger.debug(f'{self.name}: NOTIFY to {url} failed: {e}')
+            finally:
+                conn.close()
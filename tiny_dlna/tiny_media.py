@@ -0,0 +1,370 @@
+import collections
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import socket
+import subprocess
+import threading
+import urllib.parse
+import uuid
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('tiny_media')
+
+MIME_TYPES = {
+    '.srt': 'text/srt',
+    '.mkv': 'video/x-matroska',
+    '.ts': 'video/mp2t',
+}
+
+
+def get_mime_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in MIME_TYPES:
+        return MIME_TYPES[ext]
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+DLNA_FLAGS = '01700000000000000000000000000000'
+
+
+def get_content_features(time_seek):
+    # OP=10 time seek, OP=01 byte seek; see DLNA guidelines 7.4.1.3.22
+    op = '11' if time_seek else '01'
+    return f'DLNA.ORG_OP={op};DLNA.ORG_CI=0;DLNA.ORG_FLAGS={DLNA_FLAGS}'
+
+
+def parse_range(value, size):
+    # returns a list of (start, end) with `end` inclusive, an empty list
+    # when no range can be satisfied, or ValueError for a header we do
+    # not understand
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes':
+        raise ValueError(value)
+
+    ranges = []
+    for item in spec.split(','):
+        first, sep, last = item.strip().partition('-')
+        if not sep:
+            raise ValueError(value)
+        if not first:
+            # suffix range: the last N bytes
+            length = int(last)
+            if length > 0 and size > 0:
+                ranges.append((max(size - length, 0), size - 1))
+            continue
+
+        start = int(first)
+        if last and int(last) < start:
+            raise ValueError(value)
+        if start >= size:
+            # past the end, not satisfiable
+            continue
+        end = int(last) if last else size - 1
+        ranges.append((start, min(end, size - 1)))
+
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges):
+    # overlapping ranges are coalesced (RFC 7233 section 4.1), so a
+    # client can never make us send the same bytes twice
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def parse_npt(value):
+    # npt time: `123.45` or `1:02:03.45`
+    value = value.strip()
+    if ':' not in value:
+        return float(value)
+    hours, minutes, seconds = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def format_npt(seconds):
+    hours = int(seconds // 3600)
+    minutes = int(seconds % 3600 // 60)
+    return f'{hours}:{minutes:02}:{seconds % 60:06.3f}'
+
+
+def parse_time_seek_range(value):
+    m = re.match(r'\s*npt\s*=\s*([0-9:.]+)\s*-\s*([0-9:.]*)', value)
+    if not m:
+        raise ValueError(value)
+    start = parse_npt(m.group(1))
+    end = parse_npt(m.group(2)) if m.group(2) else None
+    if end is not None and end < start:
+        raise ValueError(value)
+    return start, end
+
+
+# (path, mtime, size) -> duration, None when it can not be told
+_durations = collections.OrderedDict()
+# keys ffprobe is running for
+_probing = set()
+_durations_lock = threading.Lock()
+DURATIONS_SIZE = 64
+
+
+def _probe_duration(path):
+    ffprobe = shutil.which('ffprobe')
+    if not ffprobe:
+        return None
+
+    cmd = [ffprobe, '-v', 'error', '-print_format', 'json',
+           '-show_entries', 'format=duration', path]
+    try:
+        out = subprocess.run(cmd, capture_output=True, timeout=10).stdout
+        return float(json.loads(out)['format']['duration'])
+    except (OSError, subprocess.TimeoutExpired, ValueError, KeyError):
+        return None
+
+
+def _get_duration_key(path):
+    st = os.stat(path)
+    return path, st.st_mtime, st.st_size
+
+
+def probe_duration(path):
+    # runs ffprobe, which may take seconds, once per version of the file
+    key = _get_duration_key(path)
+    with _durations_lock:
+        if key in _durations or key in _probing:
+            return
+        _probing.add(key)
+    duration = _probe_duration(path)
+    with _durations_lock:
+        _probing.discard(key)
+        _durations[key] = duration
+        if len(_durations) > DURATIONS_SIZE:
+            _durations.popitem(last=False)
+
+
+def get_duration(path):
+    # the duration is needed to map DLNA time seeks to bytes, we can
+    # only tell it when ffprobe is around. Requests never wait for it:
+    # None until probed, in the background
+    if get_mime_type(path).startswith('text/'):
+        return None
+    key = _get_duration_key(path)
+    with _durations_lock:
+        if key in _durations:
+            return _durations[key]
+        if key in _probing:
+            return None
+    threading.Thread(target=probe_duration, args=(path,), daemon=True).start()
+    return None
+
+
+def probe_durations(base_dir):
+    # for what we are about to serve, before a render asks for it
+    for name in os.listdir(base_dir):
+        path = os.path.join(base_dir, name)
+        if os.path.isfile(path):
+            get_duration(path)
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'TinyMedia/0.1'
+    # keep-alive connections from a TV that went away should not pin a
+    # thread forever
+    timeout = 60
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+    def do_HEAD(self):
+        self.serve_file(send_body=False)
+
+    def do_GET(self):
+        self.serve_file(send_body=True)
+
+    def send_error_status(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def resolve_path(self):
+        path = urllib.parse.urlsplit(self.path).path
+        prefix = self.server.url_prefix
+        if not path.startswith(prefix):
+            return None
+
+        name = urllib.parse.unquote(path[len(prefix):])
+        if not name or '/' in name or '\\' in name or name in ('.', '..'):
+            return None
+        return os.path.join(self.server.base_dir, name)
+
+    def serve_file(self, send_body):
+        path = self.resolve_path()
+        if not path:
+            return self.send_error_status(HTTPStatus.NOT_FOUND)
+
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return self.send_error_status(HTTPStatus.NOT_FOUND)
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            mime_type = get_mime_type(path)
+            dlna_headers = self.get_dlna_headers(path, mime_type)
+            ranges = None
+            time_seek = None
+
+            if self.headers.get('TimeSeekRange.dlna.org'):
+                time_seek = self.get_time_seek(path, size)
+                if time_seek is None:
+                    # we said DLNA.ORG_OP=01, i.e. byte seek only
+                    return self.send_error_status(HTTPStatus.NOT_ACCEPTABLE)
+                ranges = [time_seek[1]]
+            elif self.headers.get('Range'):
+                try:
+                    ranges = parse_range(self.headers['Range'], size)
+                except ValueError:
+                    # RFC 7233: ignore a Range header we can not parse
+                    ranges = None
+                else:
+                    if not ranges:
+                        self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+
+            if ranges is None:
+                self.send_response(HTTPStatus.OK)
+                self.send_header('Content-Type', mime_type)
+                self.send_header('Content-Length', str(size))
+                self.send_common_headers(dlna_headers)
+                self.end_headers()
+                if send_body and size:
+                    self.send_file_range(f, 0, size)
+                return
+
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            if len(ranges) == 1:
+                start, end = ranges[0]
+                self.send_header('Content-Type', mime_type)
+                self.send_header('Content-Length', str(end - start + 1))
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                if time_seek:
+                    self.send_header('TimeSeekRange.dlna.org', time_seek[0])
+                self.send_common_headers(dlna_headers)
+                self.end_headers()
+                if send_body:
+                    self.send_file_range(f, start, end - start + 1)
+                return
+
+            boundary = uuid.uuid4().hex
+            parts = []
+            for start, end in ranges:
+                head = (
+                    f'\r\n--{boundary}\r\n'
+                    f'Content-Type: {mime_type}\r\n'
+                    f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+                )
+                parts.append((head.encode('latin-1'), start, end - start + 1))
+            tail = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+            length = sum(len(h) + n for h, _, n in parts) + len(tail)
+
+            self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+            self.send_header('Content-Length', str(length))
+            self.send_common_headers(dlna_headers)
+            self.end_headers()
+            if not send_body:
+                return
+            for head, start, count in parts:
+                self.wfile.write(head)
+                if not self.send_file_range(f, start, count):
+                    return
+            self.wfile.write(tail)
+
+    def get_dlna_headers(self, path, mime_type):
+        headers = {}
+        if mime_type.startswith(('video/', 'audio/')):
+            headers['transferMode.dlna.org'] = 'Streaming'
+            time_seek = get_duration(path) is not None
+            headers['contentFeatures.dlna.org'] = get_content_features(time_seek)
+        else:
+            headers['transferMode.dlna.org'] = 'Interactive'
+
+        # the client may ask for a mode explicitly; we can do all three
+        mode = self.headers.get('transferMode.dlna.org')
+        if mode in ('Streaming', 'Interactive', 'Background'):
+            headers['transferMode.dlna.org'] = mode
+        return headers
+
+    def get_time_seek(self, path, size):
+        # returns (TimeSeekRange header value, byte range), or None when
+        # we can not map times to bytes for this file
+        duration = get_duration(path)
+        if not duration or not size:
+            return None
+        try:
+            start, end = parse_time_seek_range(self.headers['TimeSeekRange.dlna.org'])
+        except ValueError:
+            return None
+        if start >= duration:
+            return None
+
+        end = min(end if end is not None else duration, duration)
+        # assume a constant bitrate; renderers resync on the next
+        # keyframe anyway
+        first = int(size * start / duration)
+        last = max(min(int(size * end / duration), size) - 1, first)
+        value = (
+            f'npt={format_npt(start)}-{format_npt(end)}/{format_npt(duration)} '
+            f'bytes={first}-{last}/{size}'
+        )
+        return value, (first, last)
+
+    def send_common_headers(self, dlna_headers):
+        self.send_header('Accept-Ranges', 'bytes')
+        for k, v in dlna_headers.items():
+            self.send_header(k, v)
+
+    def send_file_range(self, f, offset, count):
+        try:
+            # socket.sendfile() goes through os.sendfile() where there is
+            # one, so the data never passes through Python
+            self.connection.sendfile(f, offset, count)
+        except (ConnectionError, socket.timeout) as e:
+            # TVs drop connections all the time while seeking
+            logger.debug(f'client went away: {e}')
+            self.close_connection = True
+            return False
+        return True
+
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, base_dir, port, host='0.0.0.0', url_prefix='/videos/'):
+        self.base_dir = base_dir
+        self.url_prefix = url_prefix
+        super().__init__((host, port), MediaHandler)
+
+
+def start_media_server(base_dir, port, host='0.0.0.0'):
+    # binding happens here, so the server accepts connections as soon as
+    # this returns
+    server = MediaServer(base_dir, port, host=host)
+    probe_durations(base_dir)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.debug(f'media server running at {host}:{port}, serving {base_dir}')
+    return server
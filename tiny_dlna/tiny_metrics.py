@@ -0,0 +1,139 @@
+import bisect
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger('tiny_metrics')
+
+# seconds; the slow end is for mpv opening streams over bad networks
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# what /metrics lists, in this order
+HISTOGRAMS = []
+
+
+def _format_labels(names, values, extra=''):
+    items = [f'{k}="{_escape_label(v)}"' for k, v in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    # a Prometheus histogram, cumulative buckets are only made up when
+    # rendered so an observation is one bisect and three additions
+    def __init__(self, name, description, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # label values -> [counts per bucket (+Inf last), sum]
+        self.series = {}
+        HISTOGRAMS.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(k, '') for k in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self.lock:
+            series = [(k, list(v[0]), v[1]) for k, v in sorted(self.series.items())]
+        for key, counts, total in series:
+            cumulative = 0
+            for le, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{le}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {total!r}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render_metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
+
+
+SOAP_SECONDS = Histogram(
+    'tiny_render_soap_seconds',
+    'Time spent handling a SOAP action, from receipt to response.',
+    labels=('service', 'action'),
+)
+METADATA_SECONDS = Histogram(
+    'tiny_render_metadata_parse_seconds',
+    'Time spent parsing DIDL-Lite metadata, cache hits included.',
+)
+MPV_START_SECONDS = Histogram(
+    'tiny_render_mpv_start_seconds',
+    'Time from starting mpv to its IPC connection being up.',
+)
+PLAY_STAGE_SECONDS = Histogram(
+    'tiny_render_play_stage_seconds',
+    'Time from Play to each stage: load (sent to mpv), '
+    'file_loaded (stream opened), first_frame (playback started).',
+    labels=('stage',),
+)
+
+# stages of a session in the order they happen
+PLAY_STAGES = ('load', 'file_loaded', 'first_frame')
+
+
+class PlaySession:
+    # one item played by a render, from the Play (or the switch to the
+    # queued next item) that started it to whatever ended it. Marked and
+    # ended on the event loop only.
+    def __init__(self, render, uri, controller='', user_agent='', started_at=None):
+        self.render = render
+        self.uri = uri
+        self.controller = controller
+        self.user_agent = user_agent
+        self.started_at = started_at or time.monotonic()
+        self.stages = {}
+        self.ended = False
+
+    def mark(self, stage):
+        # the first time only, a seek does not make another first frame
+        if self.ended or stage in self.stages:
+            return
+        elapsed = time.monotonic() - self.started_at
+        self.stages[stage] = elapsed
+        PLAY_STAGE_SECONDS.observe(elapsed, stage=stage)
+
+    def end(self, reason):
+        if self.ended:
+            return
+        self.ended = True
+        now = time.monotonic()
+        record = {
+            'render': self.render,
+            'uri': self.uri,
+            'controller': self.controller,
+            'user_agent': self.user_agent,
+            'end': reason,
+            'duration': round(now - self.started_at, 3),
+        }
+        for stage in PLAY_STAGES:
+            if stage in self.stages:
+                record[stage] = round(self.stages[stage], 3)
+        if 'first_frame' in self.stages:
+            record['played'] = round(now - self.started_at - self.stages['first_frame'], 3)
+        logger.info(f'session {json.dumps(record, ensure_ascii=False)}')
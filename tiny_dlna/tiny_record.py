@@ -0,0 +1,89 @@
+import datetime
+import itertools
+import logging
+import os
+import re
+
+logger = logging.getLogger('tiny_record')
+
+# characters a video title may not bring into a file name
+_UNSAFE_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+TITLE_MAX_LENGTH = 80
+
+
+def safe_title(title):
+    title = _UNSAFE_CHARS.sub('_', title or '').strip(' ._')
+    return title[:TITLE_MAX_LENGTH] or 'untitled'
+
+
+def expand_template(template, n=1, title='', now=None):
+    # `--dump-to` is a template: strftime codes (%Y%m%d-%H%M%S) taken
+    # when the segment starts, `{n}` its number and `{title}` the title
+    # of what is recorded, e.g. '~/Movie/msi-%Y%m%d-{n:03}.mp4'
+    now = now or datetime.datetime.now()
+    path = now.strftime(os.path.expanduser(template))
+    return os.path.abspath(path.format(n=n, title=safe_title(title)))
+
+
+def check_template(template):
+    # the error message for a template that cannot be expanded, or None
+    try:
+        expand_template(template)
+    except (KeyError, IndexError, ValueError) as e:
+        return f'bad file name template {template!r}: {e!r}'
+    return None
+
+
+def get_free_path(path):
+    # `path`, or `path` with -2, -3... before its extension: a recording
+    # never overwrites an earlier one
+    root, ext = os.path.splitext(path)
+    candidate = path
+    i = 1
+    while os.path.exists(candidate):
+        i += 1
+        candidate = f'{root}-{i}{ext}'
+    return candidate
+
+
+class Recording:
+    # the segments of one recording session, from Play to Stop. A new
+    # segment starts when the current one is too long or too large, and
+    # whenever the stream is (re)opened. `numbers` gives the `{n}` of
+    # each segment; a render passes the same one to all its recordings
+    # so their segments are numbered on from the last one.
+    def __init__(self, template, title='', segment_time=0, segment_size=0, numbers=None):
+        self.template = template
+        self.title = title
+        # seconds and bytes, 0 for no limit
+        self.segment_time = segment_time
+        self.segment_size = segment_size
+        self.numbers = numbers or itertools.count(1)
+        self.n = 0
+        self.path = None
+        self.started_at = None
+
+    def next_path(self):
+        now = datetime.datetime.now()
+        self.n = next(self.numbers)
+        path = get_free_path(expand_template(self.template, self.n, self.title, now))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.started_at = now
+        logger.info(f'recording segment {self.n} to {path}')
+        return path
+
+    def is_full(self):
+        if self.path is None:
+            return False
+        if self.segment_time:
+            age = (datetime.datetime.now() - self.started_at).total_seconds()
+            if age >= self.segment_time:
+                return True
+        if self.segment_size:
+            try:
+                return os.path.getsize(self.path) >= self.segment_size
+            except OSError:
+                # mpv has not written anything yet
+                return False
+        return False
@@ -1,16 +1,28 @@
 import argparse
-import html
+import asyncio
+import io
+import itertools
+import json
 import logging
-import re
 import os.path
 import signal
+import socket
 import subprocess
+import tempfile
 import threading
 import time
 import xml.etree.ElementTree as ET
 
-from flask import Flask, request, Response
-from .tiny_ssdp import get_uuid, ssdp_listener
+from flask import Flask, abort, g, request, Response
+from xml.sax.saxutils import escape as xmlescape
+from .tiny_didl import didl_cache
+from .tiny_events import EventService, build_last_change
+from .tiny_events import AVT_EVENT_NS, RCS_EVENT_NS
+from .tiny_events import parse_callbacks, parse_timeout
+from .tiny_metrics import METADATA_SECONDS, MPV_START_SECONDS, SOAP_SECONDS
+from .tiny_metrics import PlaySession, render_metrics
+from .tiny_record import Recording, check_template
+from .tiny_ssdp import get_uuid, serve_ssdp
 from .tiny_ssdp import register_render, unregister_render
 from .tiny_xmls import *  # NOQA
 
@@ -19,17 +31,308 @@ logger = logging.getLogger('tiny_render')
 PORT_DEFAULT = 59876
 
 
-class MPVRenderer:
+# properties mpv pushes to us on change, via `observe_property`
+MPV_PROPERTIES = ('time-pos', 'duration', 'pause', 'eof-reached', 'path', 'idle-active')
+_ipc_counter = itertools.count()
+# mpv's own window title, for media without one
+MPV_TITLE = '${?media-title:${media-title}}${!media-title:No file} - mpv'
+# a crashing mpv is started again after this, doubling up to the max
+RESTART_DELAY_MIN = 1
+RESTART_DELAY_MAX = 30
+# a recorded stream is opened again this many times in a row at most
+RECONNECT_MAX = 10
+MPV_QUIT_TIMEOUT = 2
+# a failing SSDP server is tried again after this, doubling up to the max
+SSDP_RETRY_MIN = 1
+SSDP_RETRY_MAX = 60
+# how often a recording is checked for being due a new segment
+RECORD_CHECK_INTERVAL = 1
+
+
+def to_track_time(seconds):
+    seconds = int(seconds)
+    hours = seconds // 3600
+    minutes = (seconds % 3600) // 60
+    remaining_seconds = seconds % 60
+    return f"{hours}:{minutes:02}:{remaining_seconds:02}"
+
+
+class TransportState:
+    # the state controllers poll for; answers are rendered once per
+    # change, so a poll costs no more than handing out cached bytes
     def __init__(self):
+        self.lock = threading.Lock()
+        self.state = 'NO_MEDIA_PRESENT'
+        self.uri = ''
+        self.next_uri = ''
+        self.position = 0
+        self.duration = 0
+        self.paused = False
+        self.listeners = []
+        self.render()
+
+    def render(self):
+        reltime = to_track_time(self.position)
+        duration = to_track_time(self.duration)
+        self.posinfo_xml = XML_POSINFO.format(reltime, duration).encode('utf-8')
+        self.transinfo_xml = XML_TRANSINFO.format(self.state).encode('utf-8')
+
+    def update(self, **changes):
+        with self.lock:
+            changed = {
+                k: v for k, v in changes.items() if getattr(self, k) != v
+            }
+            if not changed:
+                return
+            for k, v in changed.items():
+                setattr(self, k, v)
+            self.render()
+            listeners = list(self.listeners)
+
+        for listener in listeners:
+            listener(changed)
+
+    def get_event_variables(self, changes=None):
+        # LastChange variables for `changes`, all of them for None
+        variables = {}
+        if changes is None or 'state' in changes:
+            variables['TransportState'] = self.state
+            variables['TransportStatus'] = 'OK'
+        if changes is None or 'duration' in changes:
+            variables['CurrentTrackDuration'] = to_track_time(self.duration)
+            variables['CurrentMediaDuration'] = to_track_time(self.duration)
+        if changes is None or 'uri' in changes:
+            variables['AVTransportURI'] = self.uri
+            variables['CurrentTrackURI'] = self.uri
+        if changes is None or 'next_uri' in changes:
+            variables['NextAVTransportURI'] = self.next_uri
+        if changes is None:
+            variables['NumberOfTracks'] = 1 if self.uri else 0
+            variables['CurrentPlayMode'] = 'NORMAL'
+            variables['TransportPlaySpeed'] = '1'
+            variables['CurrentTransportActions'] = 'Play,Stop,Pause,Seek'
+        return variables
+
+    def on_mpv_property(self, name, value):
+        if name == 'time-pos':
+            if value is not None:
+                state = 'PAUSED_PLAYBACK' if self.paused else 'PLAYING'
+                self.update(position=int(value), state=state)
+        elif name == 'duration':
+            self.update(duration=int(value or 0))
+        elif name == 'pause':
+            paused = bool(value)
+            if self.state in ('PLAYING', 'PAUSED_PLAYBACK'):
+                state = 'PAUSED_PLAYBACK' if paused else 'PLAYING'
+                self.update(paused=paused, state=state)
+            else:
+                self.update(paused=paused)
+        elif name == 'eof-reached':
+            if value:
+                self.update(state='STOPPED')
+
+    def on_mpv_exit(self):
+        if self.state in ('PLAYING', 'PAUSED_PLAYBACK', 'TRANSITIONING'):
+            self.update(state='STOPPED', position=0)
+
+    def on_mpv_stopped(self):
+        # mpv went idle after a Stop; what it sent before it got there
+        # may have made us say PLAYING again. TRANSITIONING is a newer Play.
+        if self.state in ('PLAYING', 'PAUSED_PLAYBACK'):
+            self.update(state='STOPPED', position=0)
+
+
+class MPVRenderer:
+    # one mpv kept running idle and told what to play over IPC, so Play
+    # does not wait for mpv to start. It is started again when it dies;
+    # its IPC connection and supervision live on the event loop `loop`.
+    # Without `warm` (recorders) mpv is only started when there is
+    # something to play, and shows no window while idle.
+    def __init__(self, listener=None, warm=True):
         self.process = None
+        # what mpv should be playing, (re)sent whenever it connects
+        self.url = None
+        self.title = None
+        # a Recording, when what is played goes to files as well
+        self.recording = None
+        self.record_timer = None
+        self.reconnect_timer = None
+        self.reconnect_delay = RESTART_DELAY_MIN
+        self.reconnects = 0
+        # duration of what is loaded, None for a live stream
+        self.duration = None
+        # queued after `url` in mpv's playlist, mpv opens it ahead of time
+        self.next_url = None
+        # subtitle of the item being loaded, added once it is
+        self.pending_srt = None
+        # timings of what is playing, see tiny_metrics
+        self.session = None
+        # mpv left idle since we last told it to load something
+        self.loaded = False
+        self.loaded_at = 0
+        self.ipc = None
+        self.loop = None
+        self.closing = False
+        self.wakeup = None
+        self.supervisor = None
+        # RenderingControl state, carried over to the next mpv we start
+        self.volume = 100
+        self.mute = False
+        # called with (name, value) for every observed property change
+        self.listener = listener
+        self.warm = warm
+
+    def start(self, loop):
+        self.loop = loop
+        if hasattr(socket, 'AF_UNIX'):
+            self.wakeup = asyncio.Event()
+            # before the loop runs, from the thread that is to run it
+            self.supervisor = loop.create_task(self.supervise())
+
+    def is_playing(self, url):
+        return (self.process is not None and self.process.poll() is None
+                and self.url is not None and self.url == url)
+
+    def get_command(self, ipc_path):
+        return ['mpv', '--quiet', '--screen=1', '--no-terminal', '--idle=yes',
+                f'--force-window={"yes" if self.warm else "no"}',
+                '--prefetch-playlist=yes',
+                f'--volume={self.volume}', f'--mute={"yes" if self.mute else "no"}',
+                f'--input-ipc-server={ipc_path}']
+
+    async def supervise(self):
+        delay = RESTART_DELAY_MIN
+        while not self.closing:
+            if self.url is None and not self.warm:
+                # only started when there is something to play
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                delay = RESTART_DELAY_MIN
+                continue
 
-    def play_media(self, url, title=None, srt=None, dump_to=None):
-        self.stop_media()  # Stop any existing media
-        cmd = ['mpv', '--quiet', '--screen=1', '--no-terminal', url]
+            ipc_path = os.path.join(
+                tempfile.gettempdir(),
+                f'tiny-render-{os.getpid()}-{next(_ipc_counter)}.sock',
+            )
+            cmd = self.get_command(ipc_path)
+            logger.debug('running: {}'.format(' '.join(cmd)))
+            started_at = time.monotonic()
+            try:
+                process = subprocess.Popen(
+                    cmd, stdin=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except OSError as e:
+                logger.error(f'failed to start mpv: {e}')
+                process = None
+            else:
+                self.process = process
+                await self.ipc_session(process, ipc_path, started_at)
+                if process.poll() is None and not self.closing:
+                    # alive but not talking to us, no use
+                    process.terminate()
+                # reap it
+                while process.poll() is None:
+                    await asyncio.sleep(0.1)
+                self.process = None
+            if self.closing:
+                break
+
+            if process is not None and process.returncode == 0:
+                # closed by the user, we only come back when needed
+                logger.debug('mpv quit, waiting for the next Play')
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                delay = RESTART_DELAY_MIN
+                continue
 
-        if dump_to:
-            path_abs = os.path.abspath(dump_to)
-            cmd.append(f'--stream-record={path_abs}')
+            code = process.returncode if process else None
+            if self.url is None and not self.warm:
+                # nothing to go on with, started again at the next Play
+                logger.info(f'mpv exited ({code})')
+                continue
+            if time.monotonic() - started_at > RESTART_DELAY_MAX:
+                delay = RESTART_DELAY_MIN
+            logger.info(f'mpv exited ({code}), restarting in {delay}s')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RESTART_DELAY_MAX)
+
+    async def close(self):
+        # at exit: an idle mpv goes with us, a playing one is left to
+        # finish what it plays
+        self.closing = True
+        if not self.wakeup:
+            return
+        for timer in (self.record_timer, self.reconnect_timer):
+            if timer:
+                timer.cancel()
+        self.record_timer = self.reconnect_timer = None
+        self.end_session('shutdown')
+        process = self.process
+        if process is None or process.poll() is not None:
+            pass
+        elif self.url and self.ipc and not self.recording:
+            self.send_command('set_property', 'idle', 'no')
+            await self.ipc.drain()
+            logger.info('mpv is left open')
+        else:
+            self.send_command('quit')
+            deadline = time.monotonic() + MPV_QUIT_TIMEOUT
+            while process.poll() is None and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+        self.supervisor.cancel()
+        await asyncio.gather(self.supervisor, return_exceptions=True)
+
+    def play_media(self, url, title=None, srt=None, recording=None, session=None):
+        if not self.wakeup:
+            return self.spawn_media(url, title, srt, recording)
+        self.loop.call_soon_threadsafe(self.load, url, title, srt, recording, session)
+
+    def load(self, url, title, srt, recording, session):
+        # on the loop only
+        self.end_session('replaced')
+        self.session = session
+        self.url = url
+        self.title = title
+        self.recording = recording
+        self.reconnect_delay = RESTART_DELAY_MIN
+        self.reconnects = 0
+        self.loaded_at = 0
+        self.next_url = None
+        self.pending_srt = srt
+        self.wakeup.set()
+        self.send_load()
+        if recording and self.record_timer is None:
+            self.record_timer = self.loop.call_later(
+                RECORD_CHECK_INTERVAL, self.check_recording)
+
+    def send_load(self):
+        # on the loop only; without a connection this happens once mpv
+        # has (re)started
+        if self.ipc is None:
+            return
+        self.loaded = False
+        self.duration = None
+        self.send_command('set_property', 'title', self.title or MPV_TITLE)
+        # every (re)load of the stream goes to a segment of its own
+        record_path = self.recording.next_path() if self.recording else ''
+        self.send_command('set_property', 'stream-record', record_path)
+        self.send_command('loadfile', self.url, 'replace')
+        self.send_command('set_property', 'pause', False)
+        if self.session:
+            self.session.mark('load')
+
+    def spawn_media(self, url, title=None, srt=None, recording=None):
+        # no IPC on this platform: one mpv per Play, as it plays by itself;
+        # a recording is one segment as nobody can tell mpv to cut it
+        self.stop_media()
+        self.url = url
+        cmd = ['mpv', '--quiet', '--screen=1', '--no-terminal', url,
+               f'--volume={self.volume}', f'--mute={"yes" if self.mute else "no"}']
+        if recording:
+            cmd.append(f'--stream-record={recording.next_path()}')
         if title:
             cmd.append('--title={}'.format(title))
         if srt:
@@ -39,27 +342,367 @@ class MPVRenderer:
         self.process = subprocess.Popen(cmd, stderr=subprocess.DEVNULL)
 
     def stop_media(self):
-        if self.process:
-            self.process.terminate()
-            self.process = None
-
+        if not self.wakeup:
+            self.url = None
+            if self.process:
+                self.process.terminate()
+                self.process.wait()
+                self.process = None
+            return
+        self.loop.call_soon_threadsafe(self.stop)
+
+    def stop(self):
+        # on the loop only; mpv stays, idle
+        self.url = None
+        self.next_url = None
+        self.pending_srt = None
+        self.loaded = False
+        self.recording = None
+        self.end_session('stopped')
+        self.send_command('stop')
+        self.send_command('set_property', 'stream-record', '')
+
+    def check_recording(self):
+        # on the loop only, every RECORD_CHECK_INTERVAL while recording
+        recording = self.recording
+        if recording is None:
+            self.record_timer = None
+            return
+        if self.loaded and recording.is_full():
+            # mpv closes the current file and goes on in the new one
+            self.send_command('set_property', 'stream-record', recording.next_path())
+        self.record_timer = self.loop.call_later(RECORD_CHECK_INTERVAL, self.check_recording)
+
+    def on_record_end(self, reason):
+        # on the loop only; a stream that broke off, or a live one that
+        # ended, is opened again. A finite one was recorded to its end.
+        if reason == 'error' or (reason == 'eof' and not self.duration):
+            self.loaded = False
+            self.reconnect_later()
+        elif reason == 'eof':
+            logger.info(f'recorded to the end: {self.url}')
+            self.recording = None
+            self.send_command('set_property', 'stream-record', '')
+
+    def reconnect_later(self):
+        # on the loop only; backing off like mpv restarts do, and giving
+        # up after RECONNECT_MAX tries unless the stream was up a while
+        if self.loaded_at and time.monotonic() - self.loaded_at > RESTART_DELAY_MAX:
+            self.reconnect_delay = RESTART_DELAY_MIN
+            self.reconnects = 0
+        if self.reconnects >= RECONNECT_MAX:
+            logger.warning(f'stream lost {self.reconnects} times, giving up: {self.url}')
+            self.url = None
+            self.recording = None
+            self.send_command('set_property', 'stream-record', '')
+            self.end_session('lost')
+            if self.listener:
+                self.listener('exit', None)
+            return
+        self.reconnects += 1
+        delay = self.reconnect_delay
+        self.reconnect_delay = min(delay * 2, RESTART_DELAY_MAX)
+        logger.info(f'stream lost, reconnecting in {delay}s: {self.url}')
+        self.reconnect_timer = self.loop.call_later(delay, self.reconnect, self.recording)
+
+    def reconnect(self, recording):
+        self.reconnect_timer = None
+        if self.recording is recording and recording and not self.loaded:
+            self.send_load()
+
+    def close_ipc(self):
+        if self.ipc:
+            self.ipc.close()
+            self.ipc = None
+
+    async def connect_ipc(self, process, ipc_path):
+        # mpv creates the socket a little while after it started
+        deadline = time.monotonic() + 10
+        while process.poll() is None and time.monotonic() < deadline:
+            if self.closing:
+                return None
+            try:
+                return await asyncio.open_unix_connection(ipc_path)
+            except OSError:
+                await asyncio.sleep(0.05)
+        return None
+
+    async def ipc_session(self, process, ipc_path, started_at):
+        conn = await self.connect_ipc(process, ipc_path)
+        if conn is None:
+            logger.debug(f'failed to connect to mpv at {ipc_path}')
+            return
+
+        MPV_START_SECONDS.observe(time.monotonic() - started_at)
+        reader, writer = conn
+        self.close_ipc()
+        self.ipc = writer
+
+        for i, name in enumerate(MPV_PROPERTIES):
+            self.send_command('observe_property', i + 1, name)
+        if self.url:
+            self.send_load()
+        if self.next_url:
+            self.send_next()
+
+        # mpv pushes property changes to us, polls are answered from
+        # what the listener made of them without talking to mpv
+        while True:
+            try:
+                line = await reader.readline()
+            except (OSError, ValueError):
+                break
+            if not line:
+                break
+            self.handle_ipc_message(line)
+
+        current = self.ipc is writer
+        if current:
+            self.ipc = None
+        writer.close()
+        logger.debug('mpv ipc connection closed')
+        if current and self.recording and not self.closing:
+            # loaded again once mpv is back, into a new segment
+            logger.info('mpv went away while recording')
+            self.loaded = False
+        elif current and self.url and self.listener:
+            # mpv went away while playing (window closed, crash); what
+            # it played is not loaded again
+            self.url = None
+            self.next_url = None
+            self.end_session('mpv exited')
+            self.listener('exit', None)
+
+    def handle_ipc_message(self, line):
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            return
+        event = msg.get('event')
+        if event == 'playback-restart':
+            if self.session:
+                self.session.mark('first_frame')
+        elif event == 'file-loaded':
+            if self.session:
+                self.session.mark('file_loaded')
+            if self.pending_srt:
+                self.send_command('sub-add', self.pending_srt, 'select')
+                self.pending_srt = None
+        elif event == 'end-file':
+            if self.recording:
+                self.on_record_end(msg.get('reason'))
+        elif event == 'property-change':
+            name, value = msg['name'], msg.get('data')
+            if name == 'idle-active':
+                self.on_idle(bool(value))
+                return
+            if self.url is None:
+                # nothing is played, e.g. stopped: these are about what
+                # mpv played before it knew
+                return
+            if name == 'duration' and value is not None:
+                # kept past the end of the file, it goes before end-file
+                self.duration = value
+            if self.listener:
+                self.listener(name, value)
+
+    def on_idle(self, idle):
+        if not idle:
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+        elif self.recording:
+            # taken care of at end-file
+            pass
+        elif self.loaded:
+            # the end of the playlist, mpv waits for the next load
+            self.loaded = False
+            self.url = None
+            self.next_url = None
+            self.end_session('ended')
+            if self.listener:
+                self.listener('exit', None)
+        elif self.url is None and self.listener:
+            self.listener('stopped', None)
+
+    def send_command(self, *args):
+        # on the loop only
+        if self.ipc is None:
+            return
+        self.ipc.write(json.dumps({'command': list(args)}).encode('utf-8') + b'\n')
+
+    def command(self, *args):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.send_command, *args)
+
+    def queue_next(self, url):
+        # the item mpv moves on to when `url` ends, None for none; sent
+        # again once connected if mpv is only starting
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.set_next, url)
+
+    def set_next(self, url):
+        # on the loop only
+        self.next_url = url
+        self.send_next()
+
+    def send_next(self):
+        # on the loop only; clearing keeps the playing item, so this
+        # replaces whatever was queued before
+        self.send_command('playlist-clear')
+        if self.next_url:
+            self.send_command('loadfile', self.next_url, 'append')
+
+    def end_session(self, reason):
+        # on the loop only
+        if self.session:
+            self.session.end(reason)
+            self.session = None
+
+    def on_next_started(self, title, srt):
+        # mpv moved on to `next_url`, timed from here as it was
+        # prefetched
+        session = self.session
+        self.end_session('next')
+        if session:
+            self.session = PlaySession(
+                session.render, self.next_url, session.controller, session.user_agent)
+        self.url, self.next_url = self.next_url, None
+        self.title = title
+        self.pending_srt = srt
+        self.send_command('set_property', 'title', title or MPV_TITLE)
+
+    def seek(self, seconds):
+        self.command('seek', seconds, 'absolute')
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self.command('set_property', 'volume', volume)
+
+    def set_mute(self, mute):
+        self.mute = mute
+        self.command('set_property', 'mute', mute)
+
+
+def _cm_event_properties(changes):
+    return {
+        'SourceProtocolInfo': '',
+        'SinkProtocolInfo': 'http-get:*:*:*',
+        'CurrentConnectionIDs': '0',
+    }
 
-renderer = MPVRenderer()
 
-_DATA = {
-    'CURRENT_URI': '',
-    'CURRENT_SRT': '',
-    'VIDEO_TITLE': '',
-    'DUMP_TO': None,
-    'STARTED_AT': 0,
-}
+class Render:
+    # one DLNA render: its identity, player and state. A process can
+    # host many of them behind the same HTTP server and SSDP socket.
+    def __init__(self, name, uuid, port, path='', dump_to=None,
+                 segment_time=0, segment_size=0):
+        self.name = name
+        self.uuid = uuid
+        self.port = port
+        # '' for the main render, `/r/<id>` for the virtual ones
+        self.path = path
+        self.data = {
+            'CURRENT_URI': '',
+            'CURRENT_SRT': '',
+            'VIDEO_TITLE': '',
+            'CURRENT_URI_METADATA': '',
+            'NEXT_URI': '',
+            'NEXT_SRT': '',
+            'NEXT_TITLE': '',
+            'NEXT_URI_METADATA': '',
+            'DUMP_TO': dump_to,
+            'STARTED_AT': 0,
+        }
+        # limits of a recording's segments, in seconds and bytes
+        self.segment_time = segment_time
+        self.segment_size = segment_size
+        # the `{n}` of the next segment, numbered on across recordings
+        self.segment_numbers = itertools.count(1)
+        self.transport = TransportState()
+        self.renderer = MPVRenderer(listener=self.on_mpv_event, warm=not dump_to)
+        self.events = {
+            'AVTransport': EventService(f'{name}/AVTransport', self.avt_event_properties),
+            'RenderingControl': EventService(f'{name}/RenderingControl', self.rcs_event_properties),
+            'ConnectionManager': EventService(f'{name}/ConnectionManager', _cm_event_properties),
+        }
+        self.transport.listeners.append(self.events['AVTransport'].notify_changes)
+
+    def start(self, loop):
+        self.renderer.start(loop)
+        for events in self.events.values():
+            events.start()
+
+    def on_mpv_event(self, name, value):
+        if name == 'exit':
+            self.transport.on_mpv_exit()
+        elif name == 'stopped':
+            self.transport.on_mpv_stopped()
+        elif name == 'path':
+            renderer = self.renderer
+            if value and renderer.next_url and value == renderer.next_url:
+                self.on_next_started()
+        else:
+            self.transport.on_mpv_property(name, value)
+
+    def on_next_started(self):
+        # mpv went on to the next item by itself: it is the current one
+        # now, and there is no next until the controller sets one
+        data = self.data
+        logger.debug(f'next item started: {data["NEXT_URI"]}')
+        self.renderer.on_next_started(data['NEXT_TITLE'], data['NEXT_SRT'])
+        data['CURRENT_URI'] = data['NEXT_URI']
+        data['CURRENT_URI_METADATA'] = data['NEXT_URI_METADATA']
+        data['CURRENT_SRT'] = data['NEXT_SRT']
+        data['VIDEO_TITLE'] = data['NEXT_TITLE']
+        self.clear_next()
+        self.transport.update(uri=data['CURRENT_URI'], next_uri='', position=0, duration=0)
+
+    def clear_next(self):
+        for key in ('NEXT_URI', 'NEXT_URI_METADATA', 'NEXT_SRT', 'NEXT_TITLE'):
+            self.data[key] = ''
+
+    def set_volume(self, volume):
+        self.renderer.set_volume(volume)
+        self.events['RenderingControl'].notify_changes({'volume': volume})
+
+    def set_mute(self, mute):
+        self.renderer.set_mute(mute)
+        self.events['RenderingControl'].notify_changes({'mute': mute})
+
+    def rcs_event_properties(self, changes):
+        variables = {}
+        if changes is None or 'volume' in changes:
+            variables['Volume'] = [({'channel': 'Master'}, self.renderer.volume)]
+        if changes is None or 'mute' in changes:
+            variables['Mute'] = [({'channel': 'Master'}, int(self.renderer.mute))]
+        return {'LastChange': build_last_change(RCS_EVENT_NS, variables)}
+
+    def avt_event_properties(self, changes):
+        variables = self.transport.get_event_variables(changes)
+        if not variables:
+            return None
+        return {'LastChange': build_last_change(AVT_EVENT_NS, variables)}
+
+
+# render id ('' for the main one) -> Render
+RENDERS = {}
+
+
+def get_render(render_id):
+    render = RENDERS.get(render_id)
+    if render is None:
+        abort(404)
+    return render
 
 
 @app.route('/description.xml')
-def description():
-    friendly_name = app.config['FRIENDLY_NAME']
-    uuid_str = get_uuid(app.config['PORT'])
-    xml = XML_DESC_PTN.format(friendly_name, uuid_str)
+@app.route('/r/<render_id>/description.xml')
+def description(render_id=''):
+    render = get_render(render_id)
+    # absolute paths for the virtual renders, some controllers do not
+    # resolve relative URLs against the description location
+    url_prefix = f'{render.path}/' if render.path else ''
+    xml = XML_DESC_PTN.format(render.name, render.uuid, url_prefix)
     resp = Response(xml, mimetype="text/xml")
     resp.headers['Server'] = 'UPnP/1.0 Werkzeug/3.0 TinyRender/0.7'
     return resp
@@ -67,187 +710,490 @@ def description():
 # these 3 dlna_ routings below are only here so that some dummy app
 # could treat our "tiny render" as a proper dlna device. (Mouyu ..)
 @app.route('/dlna/AVTransport.xml')
-def dlna_avtransport():
+@app.route('/r/<render_id>/dlna/AVTransport.xml')
+def dlna_avtransport(render_id=''):
     resp = Response(XML_DLNA_AVT, mimetype="text/xml")
     return resp
 
 @app.route('/dlna/RenderingControl.xml')
-def dlna_render_control():
+@app.route('/r/<render_id>/dlna/RenderingControl.xml')
+def dlna_render_control(render_id=''):
     resp = Response(XML_DLNA_RENDER_CTRL, mimetype="text/xml")
     return resp
 
 @app.route('/dlna/ConnectionManager.xml')
-def dlna_conn_manager():
+@app.route('/r/<render_id>/dlna/ConnectionManager.xml')
+def dlna_conn_manager(render_id=''):
     resp = Response(XML_DLNA_CONN_MANAGER, mimetype="text/xml")
     return resp
 
 
-def to_track_time(seconds):
-    hours = seconds // 3600
-    minutes = (seconds % 3600) // 60
-    remaining_seconds = seconds % 60
-    return f"{hours}:{minutes:02}:{remaining_seconds:02}"
+@app.route('/<service>/event', methods=['SUBSCRIBE', 'UNSUBSCRIBE'])
+@app.route('/r/<render_id>/<service>/event', methods=['SUBSCRIBE', 'UNSUBSCRIBE'])
+def event(service, render_id=''):
+    events = get_render(render_id).events.get(service)
+    if events is None:
+        return Response(status=404)
+
+    sid = request.headers.get('SID')
+    if request.method == 'UNSUBSCRIBE':
+        if not sid or not events.unsubscribe(sid):
+            return Response(status=412)
+        logger.debug(f'{service}: unsubscribed {sid}')
+        return Response(status=200)
+
+    callback = request.headers.get('CALLBACK')
+    timeout = parse_timeout(request.headers.get('TIMEOUT'))
+    if sid:
+        if callback or request.headers.get('NT'):
+            return Response(status=400)
+        sub = events.renew(sid, timeout)
+    else:
+        callbacks = parse_callbacks(callback)
+        if request.headers.get('NT') != 'upnp:event' or not callbacks:
+            return Response(status=412)
+        sub = events.subscribe(callbacks, timeout)
 
-def is_play(request):
-    return b'<u:Play' in request.data
+    if sub is None:
+        return Response(status=412)
 
-def is_stop(request):
-    return b'<u:Stop' in request.data
+    resp = Response(status=200)
+    resp.headers['SID'] = sub.sid
+    resp.headers['TIMEOUT'] = f'Second-{sub.timeout}'
+    resp.headers['Server'] = 'UPnP/1.0 Werkzeug/3.0 TinyRender/0.7'
+    return resp
 
-def is_setav(request):
-    return b'SetAVTransportURI' in request.data
 
-def is_gettrans(request):
-    return b'u:GetTransportInfo' in request.data
+AVT_TYPE = 'urn:schemas-upnp-org:service:AVTransport:1'
+RCS_TYPE = 'urn:schemas-upnp-org:service:RenderingControl:1'
+CM_TYPE = 'urn:schemas-upnp-org:service:ConnectionManager:1'
+SOAP_BODY_TAG = '{http://schemas.xmlsoap.org/soap/envelope/}Body'
 
-def is_getpos(request):
-    return b'u:GetPositionInfo' in request.data
 
-def is_seek(request):
-    return b'u:Seek' in request.data
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
 
-def get_title_re(xml_data):
-    pattern = re.compile(r'<dc:title>(.*?)</dc:title>', re.DOTALL)
-    match = pattern.search(xml_data)
-    if match:
-        return match.group(1)
 
-def get_metadata(request):
-    root = ET.fromstring(request.data.strip())
-    current_uri = root.find('.//CurrentURI').text
-    metadata = root.find('.//CurrentURIMetaData').text
-    if not metadata:
-        logger.debug('no metadata')
-        return {'video': current_uri, 'title': ''}
+def get_soap_action(request):
+    # `SOAPACTION: "urn:schemas-upnp-org:service:AVTransport:1#Play"`
+    value = request.headers.get('SOAPACTION', '').strip().strip('"')
+    _, sep, action = value.rpartition('#')
+    if sep and action:
+        return action
 
-    title = ''
-    metadata = html.unescape(metadata)
+    # no header: the action is the first element inside the Body, we
+    # stop reading right there
+    in_body = False
     try:
-        # HACK: replace all `&` to `&amp;`
-        metadata = metadata.replace('&', '&amp;')
-        metadata = ET.fromstring(metadata.strip())
+        for _, elem in ET.iterparse(io.BytesIO(request.data.strip()), events=('start',)):
+            if in_body:
+                return _local_name(elem.tag)
+            in_body = elem.tag == SOAP_BODY_TAG
     except ET.ParseError:
-        # HACK: fall back to `re` to get title only (e.g. Huya)
-        logger.debug('** got xml.ParseError, fall back to re')
-        title = get_title_re(metadata)
-        return {'video': current_uri, 'title': title}
-
-    ns = {
-        'dc': 'http://purl.org/dc/elements/1.1/',
-        '': 'urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/'
-    }
-    item = metadata.find('.//item', namespaces=ns)
-    obj = item.find('.//dc:title', namespaces=ns)
-    if obj is not None:
-        title = obj.text
-
-    current_srt = ''
-    # Try sec:CaptionInfoEx first (Samsung standard, widely supported)
-    elem = item.find('.//{http://www.sec.co.kr/}CaptionInfoEx')
-    if elem is not None and elem.text:
-        current_srt = elem.text.strip()
-    # Try sec:CaptionInfo
-    if not current_srt:
-        elem = item.find('.//{http://www.sec.co.kr/}CaptionInfo')
-        if elem is not None and elem.text:
-            current_srt = elem.text.strip()
-    # Try pv:subtitleFileUri (Panasonic)
-    if not current_srt:
-        elem = item.find('.//{http://www.pv.com/pvns/}subtitleFileUri')
-        if elem is not None and elem.text:
-            current_srt = elem.text.strip()
-    # Try res with subtitle type or srt protocolInfo
-    if not current_srt:
-        for res in metadata.findall('.//{urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/}res'):
-            proto = res.get('protocolInfo', '')
-            if res.get('type') == 'text/subtitle' or 'text/srt' in proto:
-                if res.text:
-                    current_srt = res.text.strip()
-                    break
+        pass
+    return None
 
-    return {
-        'video': current_uri,
-        'srt': current_srt,
-        'title': title,
-    }
 
+def get_action_args(request):
+    return parse_action_args(request.data)
 
-@app.route('/AVTransport/control', methods=['POST'])
-def control():
-    if is_setav(request):
-        metadata = get_metadata(request)
-        current_uri = metadata['video']
-        current_srt = metadata.get('srt', '')
-        video_title = metadata.get('title', '')
-
-        logger.debug(f'Action: SetAV: {current_uri}')
-        logger.debug(f'Title: {video_title} SRT: {current_srt}')
-        _DATA['CURRENT_URI'] = current_uri
-        _DATA['CURRENT_SRT'] = current_srt
-        _DATA['VIDEO_TITLE'] = video_title
-        return Response(XML_AVSET_DONE, mimetype="text/xml")
-
-    elif is_play(request):
-        if _DATA['STARTED_AT'] > 0 and _DATA['DUMP_TO']:
-            app.config['STOP'] = True
-            exit(0)
-
-        _DATA['STARTED_AT'] = time.time()
-        url = _DATA['CURRENT_URI']
-        srt = _DATA['CURRENT_SRT']
-        title = _DATA['VIDEO_TITLE']
-        dump_to = _DATA['DUMP_TO']
-        logger.debug(f'action: Play: {url}')
-        renderer.play_media(url, title, srt, dump_to)
+
+def parse_action_args(data):
+    # in-arguments of the action by name, None for a broken body. The
+    # envelope is parsed whole, CurrentURIMetaData included: GetMediaInfo
+    # hands it back as is, so its text is needed in full anyway. That is
+    # one more pass over big payloads than parse_didl's bounded one,
+    # bench/bench_didl.py times both.
+    try:
+        root = ET.fromstring(data.strip())
+    except ET.ParseError:
+        return None
+    body = root.find(SOAP_BODY_TAG)
+    if body is None or len(body) == 0:
+        return None
+    return {_local_name(arg.tag): arg.text or '' for arg in body[0]}
+
+
+def soap_response(service_type, action, **out_args):
+    body = ''.join(f'<{k}>{xmlescape(str(v))}</{k}>' for k, v in out_args.items())
+    xml = XML_ACTION_DONE.format(service_type, action, body)
+    return Response(xml, mimetype='text/xml')
+
+
+def soap_error(code, description):
+    xml = XML_SOAP_FAULT.format(code, description)
+    return Response(xml, status=500, mimetype='text/xml')
+
+
+def from_track_time(value):
+    # `H+:MM:SS[.F+]`, as used by Seek's REL_TIME/ABS_TIME targets
+    parts = value.strip().split(':')
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def get_seek_target(args):
+    unit = args.get('Unit')
+    target = args.get('Target')
+    if not target:
+        return None
+    if unit and unit not in ('REL_TIME', 'ABS_TIME'):
+        return None
+    return from_track_time(target)
+
+def parse_metadata(uri, metadata):
+    started_at = time.monotonic()
+    result = didl_cache.parse(uri, metadata)
+    METADATA_SECONDS.observe(time.monotonic() - started_at)
+    return result
+
+
+def avt_set_uri(render):
+    transport = render.transport
+    data = render.data
+    args = get_action_args(request)
+    if args is None or 'CurrentURI' not in args:
+        return soap_error(402, 'Invalid Args')
+
+    metadata = parse_metadata(args['CurrentURI'], args.get('CurrentURIMetaData'))
+    current_uri = metadata['video']
+    current_srt = metadata.get('srt', '')
+    video_title = metadata.get('title', '')
+
+    logger.debug(f'Action: SetAV: {current_uri}')
+    logger.debug(f'Title: {video_title} SRT: {current_srt}')
+    data['CURRENT_URI'] = current_uri
+    data['CURRENT_URI_METADATA'] = args.get('CurrentURIMetaData', '')
+    data['CURRENT_SRT'] = current_srt
+    data['VIDEO_TITLE'] = video_title
+    if transport.state == 'NO_MEDIA_PRESENT':
+        transport.update(state='STOPPED', uri=current_uri)
+    else:
+        transport.update(uri=current_uri)
+    return Response(XML_AVSET_DONE, mimetype="text/xml")
+
+
+def avt_play(render):
+    transport = render.transport
+    renderer = render.renderer
+    data = render.data
+    if (transport.state == 'PAUSED_PLAYBACK'
+            and renderer.is_playing(data['CURRENT_URI'])):
+        # a URI set while paused is loaded below instead
+        logger.debug('action: Play: resume')
+        renderer.command('set_property', 'pause', False)
         return Response(XML_PLAY_DONE, mimetype="text/xml")
 
-    elif is_getpos(request):
-        # this is only a dummy impl; we need rpc to mpv process for real.
-        logger.debug('action: GetPositionInfo')
-        seconds = int(time.time() - _DATA['STARTED_AT'])
-        reltime = to_track_time(seconds)
-        return Response(XML_POSINFO.format(reltime), mimetype="text/xml")
+    if not data['CURRENT_URI']:
+        return soap_error(701, 'Transition not available')
+
+    if (transport.state in ('PLAYING', 'TRANSITIONING')
+            and renderer.is_playing(data['CURRENT_URI'])):
+        # the controller resent what we are already playing
+        logger.debug('action: Play: already playing')
+        return Response(XML_PLAY_DONE, mimetype="text/xml")
 
-    elif is_gettrans(request):
-        logger.debug('action: GetTransportInfo')
-        return Response(XML_TRANSINFO, mimetype="text/xml")
+    data['STARTED_AT'] = time.time()
+    url = data['CURRENT_URI']
+    srt = data['CURRENT_SRT']
+    title = data['VIDEO_TITLE']
+    recording = None
+    if data['DUMP_TO']:
+        recording = Recording(data['DUMP_TO'], title, render.segment_time,
+                              render.segment_size, render.segment_numbers)
+    logger.debug(f'action: Play: {url}')
+    transport.update(state='TRANSITIONING', position=0, duration=0, paused=False)
+    session = PlaySession(
+        render.name, url, request.remote_addr or '',
+        request.headers.get('User-Agent', ''), g.received_at)
+    renderer.play_media(url, title, srt, recording, session)
+    if data['NEXT_URI'] and not recording:
+        renderer.queue_next(data['NEXT_URI'])
+    return Response(XML_PLAY_DONE, mimetype="text/xml")
+
+
+def avt_pause(render):
+    logger.debug('action: Pause')
+    if render.transport.state not in ('PLAYING', 'TRANSITIONING'):
+        return soap_error(701, 'Transition not available')
+    render.renderer.command('set_property', 'pause', True)
+    return soap_response(AVT_TYPE, 'Pause')
+
+
+def avt_stop(render):
+    logger.debug('stopping')
+    data = render.data
+    data['STARTED_AT'] = 0
+    render.renderer.stop_media()
+    # the URI (and what comes next) stays, a Play plays it again
+    state = 'STOPPED' if data['CURRENT_URI'] else 'NO_MEDIA_PRESENT'
+    render.transport.update(state=state, position=0, duration=0)
+    return Response(XML_STOP_DONE, mimetype="text/xml")
+
+
+def avt_seek(render):
+    args = get_action_args(request)
+    try:
+        seconds = get_seek_target(args) if args is not None else None
+    except ValueError:
+        seconds = None
+    logger.debug(f'action: Seek: {seconds}')
+    if seconds is None:
+        return soap_error(710, 'Seek mode not supported')
+    render.renderer.seek(seconds)
+    return Response(XML_SEEK_DONE, mimetype="text/xml")
+
+
+def avt_set_next_uri(render):
+    args = get_action_args(request)
+    if args is None or 'NextURI' not in args:
+        return soap_error(402, 'Invalid Args')
+
+    data = render.data
+    if not args['NextURI']:
+        # the controller dropped what it had queued
+        render.clear_next()
+    else:
+        metadata = parse_metadata(args['NextURI'], args.get('NextURIMetaData'))
+        data['NEXT_URI'] = metadata['video']
+        data['NEXT_URI_METADATA'] = args.get('NextURIMetaData', '')
+        data['NEXT_SRT'] = metadata.get('srt', '')
+        data['NEXT_TITLE'] = metadata.get('title', '')
+    logger.debug(f'action: SetNextAVTransportURI: {data["NEXT_URI"]}')
+
+    renderer = render.renderer
+    if renderer.is_playing(data['CURRENT_URI']) and not data['DUMP_TO']:
+        renderer.queue_next(data['NEXT_URI'] or None)
+    render.transport.update(next_uri=data['NEXT_URI'])
+    return soap_response(AVT_TYPE, 'SetNextAVTransportURI')
+
+
+def avt_next(render):
+    data = render.data
+    if not data['NEXT_URI'] or not render.renderer.is_playing(data['CURRENT_URI']):
+        return soap_error(711, 'Illegal seek target')
+    logger.debug('action: Next')
+    render.renderer.command('playlist-next')
+    return soap_response(AVT_TYPE, 'Next')
+
+
+def avt_previous(render):
+    # what was played is not kept, there is nothing to go back to
+    return soap_error(711, 'Illegal seek target')
+
+
+def avt_get_position_info(render):
+    logger.debug('action: GetPositionInfo')
+    return Response(render.transport.posinfo_xml, mimetype="text/xml")
+
+
+def avt_get_transport_info(render):
+    logger.debug('action: GetTransportInfo')
+    return Response(render.transport.transinfo_xml, mimetype="text/xml")
+
+
+def avt_get_media_info(render):
+    transport = render.transport
+    return soap_response(
+        AVT_TYPE, 'GetMediaInfo',
+        NrTracks=1 if transport.uri else 0,
+        MediaDuration=to_track_time(transport.duration),
+        CurrentURI=transport.uri,
+        CurrentURIMetaData=render.data.get('CURRENT_URI_METADATA', ''),
+        NextURI=render.data['NEXT_URI'],
+        NextURIMetaData=render.data['NEXT_URI_METADATA'],
+        PlayMedium='NETWORK',
+        RecordMedium='NOT_IMPLEMENTED',
+        WriteStatus='NOT_IMPLEMENTED',
+    )
 
-    elif is_stop(request):
-        logger.debug('stopping')
 
-        if _DATA['STARTED_AT'] > 0 and _DATA['DUMP_TO']:
-            app.config['STOP'] = True
-            logger.info('stopping the recorder as a whole')
-            exit(0)
+def avt_get_transport_settings(render):
+    return soap_response(
+        AVT_TYPE, 'GetTransportSettings',
+        PlayMode='NORMAL', RecQualityMode='NOT_IMPLEMENTED',
+    )
 
-        _DATA['CURRENT_URI'] = ''
-        _DATA['CURRENT_SRT'] = ''
-        _DATA['VIDEO_TITLE'] = ''
-        _DATA['STARTED_AT'] = 0
-        renderer.stop_media()
-        return Response(XML_STOP_DONE, mimetype="text/xml")
 
-    elif is_seek(request):
-        logger.debug('action:seek')
-        return Response(XML_SEEK_DONE, mimetype="text/xml")
+def avt_get_device_capabilities(render):
+    return soap_response(
+        AVT_TYPE, 'GetDeviceCapabilities',
+        PlayMedia='NETWORK', RecMedia='NOT_IMPLEMENTED',
+        RecQualityModes='NOT_IMPLEMENTED',
+    )
 
-    logger.error(f'action not support: {request.data}')
-    return Response('Action Not Supported', status=500)
 
+def avt_get_current_transport_actions(render):
+    state = render.transport.state
+    if state == 'PLAYING':
+        actions = 'Stop,Pause,Seek'
+        if render.data['NEXT_URI']:
+            actions += ',Next'
+    elif state == 'PAUSED_PLAYBACK':
+        actions = 'Play,Stop,Seek'
+    elif state == 'STOPPED':
+        actions = 'Play'
+    else:
+        actions = ''
+    return soap_response(AVT_TYPE, 'GetCurrentTransportActions', Actions=actions)
+
+
+def avt_set_play_mode(render):
+    args = get_action_args(request) or {}
+    if args.get('NewPlayMode') != 'NORMAL':
+        return soap_error(712, 'Play mode not supported')
+    return soap_response(AVT_TYPE, 'SetPlayMode')
+
+
+AVT_ACTIONS = {
+    'SetAVTransportURI': avt_set_uri,
+    'SetNextAVTransportURI': avt_set_next_uri,
+    'Play': avt_play,
+    'Pause': avt_pause,
+    'Stop': avt_stop,
+    'Seek': avt_seek,
+    'Next': avt_next,
+    'Previous': avt_previous,
+    'GetPositionInfo': avt_get_position_info,
+    'GetTransportInfo': avt_get_transport_info,
+    'GetMediaInfo': avt_get_media_info,
+    'GetTransportSettings': avt_get_transport_settings,
+    'GetDeviceCapabilities': avt_get_device_capabilities,
+    'GetCurrentTransportActions': avt_get_current_transport_actions,
+    'SetPlayMode': avt_set_play_mode,
+}
 
-class SSDPServer(threading.Thread):
-    def __init__(self):
-        super().__init__()
 
-    def run(self):
-        while True:
-            try:
-                ssdp_listener()
-            except OSError:
-                # another SSDP Server is running
-                time.sleep(0.05)
-                continue
-            break
+def rcs_get_volume(render):
+    return soap_response(RCS_TYPE, 'GetVolume', CurrentVolume=render.renderer.volume)
+
+
+def rcs_set_volume(render):
+    args = get_action_args(request) or {}
+    try:
+        volume = int(args.get('DesiredVolume', ''))
+    except ValueError:
+        return soap_error(402, 'Invalid Args')
+    if not 0 <= volume <= 100:
+        return soap_error(601, 'Argument Value Out of Range')
+    logger.debug(f'action: SetVolume: {volume}')
+    render.set_volume(volume)
+    return soap_response(RCS_TYPE, 'SetVolume')
+
+
+def rcs_get_mute(render):
+    return soap_response(RCS_TYPE, 'GetMute', CurrentMute=int(render.renderer.mute))
+
+
+def rcs_set_mute(render):
+    args = get_action_args(request) or {}
+    value = args.get('DesiredMute', '').strip().lower()
+    if value not in ('0', '1', 'true', 'false', 'yes', 'no'):
+        return soap_error(402, 'Invalid Args')
+    logger.debug(f'action: SetMute: {value}')
+    render.set_mute(value in ('1', 'true', 'yes'))
+    return soap_response(RCS_TYPE, 'SetMute')
+
+
+def rcs_get_volume_db(render):
+    # no dB scale, mpv's volume is a percentage
+    return soap_response(RCS_TYPE, 'GetVolumeDB', CurrentVolume=0)
+
+
+def rcs_get_volume_db_range(render):
+    return soap_response(RCS_TYPE, 'GetVolumeDBRange', MinValue=0, MaxValue=0)
+
+
+def rcs_list_presets(render):
+    return soap_response(RCS_TYPE, 'ListPresets', CurrentPresetNameList='FactoryDefaults')
+
+
+def rcs_select_preset(render):
+    args = get_action_args(request) or {}
+    if args.get('PresetName') != 'FactoryDefaults':
+        return soap_error(701, 'Invalid Name')
+    render.set_volume(100)
+    render.set_mute(False)
+    return soap_response(RCS_TYPE, 'SelectPreset')
+
+
+RCS_ACTIONS = {
+    'GetVolume': rcs_get_volume,
+    'SetVolume': rcs_set_volume,
+    'GetMute': rcs_get_mute,
+    'SetMute': rcs_set_mute,
+    'GetVolumeDB': rcs_get_volume_db,
+    'GetVolumeDBRange': rcs_get_volume_db_range,
+    'ListPresets': rcs_list_presets,
+    'SelectPreset': rcs_select_preset,
+}
+
+
+def cm_get_protocol_info(render):
+    return soap_response(CM_TYPE, 'GetProtocolInfo', Source='', Sink='http-get:*:*:*')
+
+
+def cm_get_current_connection_ids(render):
+    return soap_response(CM_TYPE, 'GetCurrentConnectionIDs', ConnectionIDs='0')
+
+
+def cm_get_current_connection_info(render):
+    args = get_action_args(request) or {}
+    if args.get('ConnectionID', '0') != '0':
+        return soap_error(706, 'Invalid connection reference')
+    return soap_response(
+        CM_TYPE, 'GetCurrentConnectionInfo',
+        RcsID=0, AVTransportID=0, ProtocolInfo='', PeerConnectionManager='',
+        PeerConnectionID=-1, Direction='Input', Status='OK',
+    )
+
+
+CM_ACTIONS = {
+    'GetProtocolInfo': cm_get_protocol_info,
+    'GetCurrentConnectionIDs': cm_get_current_connection_ids,
+    'GetCurrentConnectionInfo': cm_get_current_connection_info,
+}
+
+
+def dispatch(render_id, service, actions):
+    g.received_at = time.monotonic()
+    render = get_render(render_id)
+    action = get_soap_action(request)
+    handler = actions.get(action)
+    if handler is None:
+        logger.error(f'action not support: {action}')
+        response = soap_error(401, 'Invalid Action')
+        # not labeled by name, anybody can make those up
+        action = 'unknown'
+    else:
+        response = handler(render)
+    SOAP_SECONDS.observe(time.monotonic() - g.received_at, service=service, action=action)
+    return response
+
+
+@app.route('/AVTransport/control', methods=['POST'])
+@app.route('/r/<render_id>/AVTransport/control', methods=['POST'])
+def control(render_id=''):
+    return dispatch(render_id, 'AVTransport', AVT_ACTIONS)
+
+
+@app.route('/RenderingControl/action', methods=['POST'])
+@app.route('/r/<render_id>/RenderingControl/action', methods=['POST'])
+def rendering_control(render_id=''):
+    return dispatch(render_id, 'RenderingControl', RCS_ACTIONS)
+
+
+@app.route('/ConnectionManager/action', methods=['POST'])
+@app.route('/r/<render_id>/ConnectionManager/action', methods=['POST'])
+def connection_manager(render_id=''):
+    return dispatch(render_id, 'ConnectionManager', CM_ACTIONS)
+
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text format, for all renders of the process
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 
 def _get_friendly_name(args):
@@ -260,27 +1206,61 @@ def _get_friendly_name(args):
     return args.name
 
 
-def flask_app_monitor(uuid, port):
-    to_stop = app.config.get('STOP')
-    while app.config.get('STOP') is None:
-        time.sleep(0.05)
+def unregister_renders():
+    for render in RENDERS.values():
+        unregister_render(render.uuid)
+        logger.debug(f'unregistered render: {render.uuid}')
 
-    unregister_render(uuid)
-    logger.debug(f'unregistered render: {uuid}')
-    logger.info('killing render process. mpv process is left open')
-    pid = os.getpid()
-    os.kill(pid, signal.SIGTERM)
 
+class RenderCore:
+    # the one event loop of the process: SSDP, mpv IPC and shutdown all
+    # happen here, HTTP handlers hand work over with *_threadsafe calls
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.stopped = self.loop.create_future()
 
-def signal_handler(signal, frame):
-    logger.debug('got killing signal')
-    uuid = get_uuid(app.config['PORT'])
-    unregister_render(uuid)
-    logger.debug(f'unregistered render: {uuid}')
-    exit(0)
+    def request_stop(self):
+        # from any thread, e.g. a signal handler on Windows
+        self.loop.call_soon_threadsafe(self.stop)
 
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
+    def stop(self):
+        if not self.stopped.done():
+            self.stopped.set_result(None)
+
+    async def serve_ssdp(self, ipv6):
+        delay = SSDP_RETRY_MIN
+        while True:
+            try:
+                await serve_ssdp(ipv6)
+                break
+            except OSError as e:
+                # e.g. no network yet; HTTP goes on meanwhile, only
+                # discovery is down
+                logger.error(f'SSDP server failed: {e}, retrying in {delay}s')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, SSDP_RETRY_MAX)
+
+    async def serve(self, ipv6):
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                # Windows
+                signal.signal(sig, lambda *args: self.request_stop())
+
+        ssdp = self.loop.create_task(self.serve_ssdp(ipv6))
+        await self.stopped
+        logger.debug('shutting down')
+        ssdp.cancel()
+        # byebye goes out for every render
+        unregister_renders()
+        await asyncio.gather(*(r.renderer.close() for r in RENDERS.values()))
+
+    def run(self, ipv6):
+        try:
+            self.loop.run_until_complete(self.serve(ipv6))
+        finally:
+            self.loop.close()
 
 
 def main():
@@ -289,7 +1269,17 @@ def main():
     parser.add_argument('--verbose', '-v', action='store_true', help='Enable debug logs')
     parser.add_argument('--name', type=str, help='Specify render name')
     parser.add_argument('--port', type=int, default=0, help='Server Port')
-    parser.add_argument('--dump-to', type=str, help='dump streaming to a file')
+    parser.add_argument('--dump-to', type=str,
+                        help='dump streaming to files named after this template, '
+                             'e.g. "~/Movie/msi-%%Y%%m%%d-{n:03}.mp4"')
+    parser.add_argument('--segment-time', type=int, default=0, metavar='SECONDS',
+                        help='start a new file when a recording is this long')
+    parser.add_argument('--segment-size', type=int, default=0, metavar='MB',
+                        help='start a new file when a recording is this large')
+    parser.add_argument('--render', action='append', default=[], metavar='NAME',
+                        help='Host one more render in this process (repeatable)')
+    parser.add_argument('--recorder', action='append', default=[], metavar='NAME=FILE',
+                        help='Host one more recorder in this process (repeatable)')
 
     args = parser.parse_args()
 
@@ -306,46 +1296,68 @@ def main():
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
+    # one line per playing session, and per recorded segment
+    logging.getLogger('tiny_metrics').setLevel(logging.INFO)
+    logging.getLogger('tiny_record').setLevel(logging.INFO)
+
+    recorders = []
+    for value in args.recorder:
+        name, sep, dump_to = value.partition('=')
+        if not sep or not name or not dump_to:
+            logger.error(f'bad --recorder, expect NAME=FILE: {value}')
+            exit(1)
+        recorders.append((f'{name} (Recorder)', dump_to))
 
-    port = PORT_DEFAULT
-    if args.dump_to:
-        file_dump = os.path.abspath(args.dump_to)
-        if os.path.exists(file_dump):
-            logger.error(f'target file exists: {file_dump}')
+    # existing files are not overwritten, the next free name is taken
+    for dump_to in [args.dump_to] + [x[1] for x in recorders]:
+        error = check_template(dump_to) if dump_to else None
+        if error:
+            logger.error(error)
             exit(1)
+    segments = {
+        'segment_time': args.segment_time,
+        'segment_size': args.segment_size * 1024 * 1024,
+    }
 
-        _DATA['DUMP_TO'] = args.dump_to
+    port = PORT_DEFAULT
+    if args.dump_to:
         port += 1
 
     if args.port:
         port = args.port
 
-    ssdp = SSDPServer()
-    ssdp.start()
-
+    # one socket takes both IPv4 and IPv6 where the OS allows it (not on
+    # Windows, where IPV6_V6ONLY is on by default); only then can we
+    # hand out IPv6 Locations
+    ipv6 = socket.has_dualstack_ipv6() and os.name != 'nt'
     friendly_name = _get_friendly_name(args)
-    app.config['FRIENDLY_NAME'] = friendly_name
-    app.config['PORT'] = port
-    logger.info(f'Starting DLNA Receiver: {friendly_name}')
-    if args.dump_to:
-        logger.info(f'Recording stream to {args.dump_to}')
-
     uuid = get_uuid(port)
-    register_render(uuid, friendly_name, port)
-    logger.debug(f'registered render {uuid}')
-
+    RENDERS[''] = Render(friendly_name, uuid, port, dump_to=args.dump_to, **segments)
+    # virtual renders share the HTTP port, each under its own path
+    extra = [(name, None) for name in args.render] + recorders
+    for i, (name, dump_to) in enumerate(extra, 1):
+        RENDERS[str(i)] = Render(name, f'{uuid}-{i}', port, f'/r/{i}', dump_to, **segments)
+
+    core = RenderCore()
+    for render in RENDERS.values():
+        render.start(core.loop)
+        logger.info(f'Starting DLNA Receiver: {render.name}')
+        if render.data['DUMP_TO']:
+            logger.info(f'Recording stream to {render.data["DUMP_TO"]}')
+        register_render(render.uuid, render.name, port, render.path)
+        logger.debug(f'registered render {render.uuid}')
+
+    # Flask keeps its own thread; its handlers only read pre-rendered
+    # state or pass commands on to the loop
     app_server = threading.Thread(
         target=app.run,
-        kwargs={'host': '0.0.0.0', 'port': port},
+        kwargs={'host': '::' if ipv6 else '0.0.0.0', 'port': port},
+        daemon=True,
     )
     app_server.start()
 
-    thread = threading.Thread(
-        target=flask_app_monitor,
-        kwargs={'uuid': uuid, 'port': port},
-    )
-    thread.start()
-    thread.join()
+    core.run(ipv6)
+    logger.info('render process exits')
 
 
 if __name__ == "__main__":
@@ -1,18 +1,45 @@
+import asyncio
+import collections
 import datetime
+import ipaddress
 import json
 import logging
 import os
 import psutil
+import random
+import re
 import socket
+import struct
+import threading
+import time
 import uuid
 
 SSDP_MULTICAST_IP = '239.255.255.250'
+# link-local scope, UPnP 1.1 annex A
+SSDP_MULTICAST_IP6 = 'ff02::c'
 SSDP_PORT = 1900
 logger = logging.getLogger('tiny_ssdp')
 logger.setLevel(logging.DEBUG)
 
 ST_VALUE_MEDIARENDERER = 'mediarenderer'
 ST_VALUE_AVTRANSPORT = 'avtransport'
+# how often the registry looks at live-renders.json / the host IP
+REGISTRY_CHECK_INTERVAL = 1.0
+HOST_IP_CHECK_INTERVAL = 10.0
+# repeated M-SEARCHes from one address for one ST and MX within this many
+# seconds are answered once
+DEDUP_WINDOW = 2.0
+# UPnP 1.1: MX is capped at 5 seconds
+MX_MAX = 5
+# token bucket for all responses we send
+RATE_BURST = 200
+RATE_PER_SECOND = 100.0
+MAX_AGE = 70
+# ssdp:alive goes out well within MAX_AGE, so that a lost packet or two
+# does not make controllers forget us
+NOTIFY_INTERVAL = MAX_AGE / 2 - 5
+NOTIFY_JITTER = 5.0
+SERVER_HEADER = 'Werkzeug/3.0 TinyRender/0.6'
 
 
 def get_config_file(file_name):
@@ -22,7 +49,16 @@ def get_config_file(file_name):
     return os.path.join(app_data_dir, file_name)
 
 
-def register_render(uuid, name, port):
+def _write_live_renders(config_file, data):
+    # a host process (un)registers many renders in a row, and SSDP
+    # servers read the file meanwhile, never leave half a file around
+    tmp_file = f'{config_file}.{os.getpid()}'
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, sort_keys=True, indent=4)
+    os.replace(tmp_file, config_file)
+
+
+def register_render(uuid, name, port, path=''):
     config_file = get_config_file('live-renders.json')
     data = {'renders': []}
     if os.path.exists(config_file):
@@ -41,9 +77,9 @@ def register_render(uuid, name, port):
     if 'renders' not in data:
         data['renders'] = []
 
-    data['renders'].append({'uuid': uuid, 'name': name, 'port': port})
-    with open(config_file, 'w') as f:
-        json.dump(data, f, sort_keys=True, indent=4)
+    data['renders'].append({'uuid': uuid, 'name': name, 'port': port, 'path': path})
+    _write_live_renders(config_file, data)
+    registry.invalidate()
 
 
 def unregister_render(uuid):
@@ -57,11 +93,11 @@ def unregister_render(uuid):
     if 'renders' not in data:
         return
 
-    found = False
+    found = None
     others = []
     for render in data.get('renders', []):
         if render['uuid'] == uuid:
-            found = True
+            found = render
         else:
             others.append(render)
 
@@ -69,8 +105,9 @@ def unregister_render(uuid):
         return
 
     data = {'renders': others}
-    with open(config_file, 'w') as f:
-        json.dump(data, f, sort_keys=True, indent=4)
+    _write_live_renders(config_file, data)
+    registry.invalidate()
+    send_byebye(found)
 
 
 def get_uuid(port):
@@ -89,31 +126,151 @@ def get_uuid(port):
     return uuid_str + f'-{port}'
 
 
-def get_host_ip():
-    ips = []
-    interfaces = psutil.net_if_addrs()
+Interface = collections.namedtuple('Interface', ['name', 'index', 'ip', 'network'])
+
+
+def _read_interfaces():
+    result = []
+    for name, addresses in psutil.net_if_addrs().items():
+        try:
+            index = socket.if_nametoindex(name)
+        except OSError:
+            index = 0
+        for address in addresses:
+            if address.family not in (socket.AF_INET, socket.AF_INET6):
+                continue
+            if not address.address or not address.netmask:
+                continue
+            # link-local IPv6 comes as `fe80::1%eth0`
+            ip = address.address.split('%')[0]
+            try:
+                ip_addr = ipaddress.ip_address(ip)
+                mask = int(ipaddress.ip_address(address.netmask))
+            except ValueError:
+                continue
+            if ip_addr.is_loopback or ip_addr.is_unspecified:
+                continue
+            if ip_addr.version == 4 and ip_addr.is_link_local:
+                continue
+            prefix = bin(mask).count('1')
+            network = ipaddress.ip_network(f'{ip}/{prefix}', strict=False)
+            result.append(Interface(name, index, ip, network))
+    return result
+
+
+class InterfaceTable:
+    # the addresses of this host, psutil is walked again at most once
+    # per HOST_IP_CHECK_INTERVAL; `version` changes with the table
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interfaces = []
+        self.checked_at = None
+        self.version = 0
+
+    def get(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.checked_at is None or now - self.checked_at >= HOST_IP_CHECK_INTERVAL:
+                self.checked_at = now
+                interfaces = _read_interfaces()
+                if interfaces != self.interfaces:
+                    logger.debug(f'interfaces: {[(x.name, x.ip) for x in interfaces]}')
+                    self.interfaces = interfaces
+                    self.version += 1
+            return self.interfaces
+
+
+interfaces = InterfaceTable()
+
+
+def _ipv4_rank(iface):
+    # home networks first, then the other private ranges, where 172.16/12
+    # is often a docker or VM bridge
+    ip = ipaddress.ip_address(iface.ip)
+    if ip in ipaddress.ip_network('192.168.0.0/16'):
+        rank = 0
+    elif ip in ipaddress.ip_network('10.0.0.0/8'):
+        rank = 1
+    elif ip.is_private:
+        rank = 2
+    else:
+        rank = 3
+    return rank, ip
 
-    for iface_name, iface_addresses in interfaces.items():
-        for address in iface_addresses:
-            if address.family == socket.AF_INET:
-                ip = address.address
-                if ip and ip.startswith('192.168.'):
-                    ips.append(ip)
 
+def get_host_ip():
+    ips = [x for x in interfaces.get() if x.network.version == 4]
     if len(ips) == 0:
         logger.error('failed to find host IP.')
-
-    # use the smallest one, in case get like 192.168.65.1 (vm interfaces)
-    ips.sort()
-    return ips[0]
-
-
-def build_m_search_response(st, render_port):
+        return '127.0.0.1'
+
+    # lowest in the rank, so a machine gives out the same one each time
+    return min(ips, key=_ipv4_rank).ip
+
+
+def _get_route_ip(peer_ip):
+    # the source address the kernel would pick to reach `peer_ip`; no
+    # packet is sent for a UDP connect()
+    family = socket.AF_INET6 if ':' in peer_ip else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        sock.connect((peer_ip, SSDP_PORT))
+        return sock.getsockname()[0].split('%')[0]
+    except OSError:
+        return None
+    finally:
+        sock.close()
+
+
+def get_local_ip(peer_ip, scope_id=0):
+    # our address on the interface `peer_ip` talks to us through: the one
+    # on its subnet (for IPv6 link-local, on the interface of `scope_id`)
+    peer_ip = peer_ip.split('%')[0]
+    try:
+        peer = ipaddress.ip_address(peer_ip)
+    except ValueError:
+        # a host name
+        return _get_route_ip(peer_ip) or get_host_ip()
+    if isinstance(peer, ipaddress.IPv6Address) and peer.ipv4_mapped:
+        peer = peer.ipv4_mapped
+
+    candidates = [x for x in interfaces.get() if x.network.version == peer.version]
+    if peer.version == 6 and peer.is_link_local and scope_id:
+        on_link = [x for x in candidates if x.index == scope_id]
+        # a routable address on that link works for the peer as well
+        # and needs no zone in the URL
+        for iface in on_link:
+            if not ipaddress.ip_address(iface.ip).is_link_local:
+                return iface.ip
+        if on_link:
+            return on_link[0].ip
+
+    for iface in candidates:
+        if peer in iface.network:
+            return iface.ip
+
+    return _get_route_ip(str(peer)) or get_host_ip()
+
+
+def format_url_host(ip):
+    return f'[{ip}]' if ':' in ip else ip
+
+
+def get_location(render, render_ip):
+    render_path = render.get('path', '')
+    return f'http://{format_url_host(render_ip)}:{render["port"]}{render_path}/description.xml'
+
+
+def get_date_header():
     now = datetime.datetime.utcnow()
     date_str = now.strftime("%a, %d %b %Y %H:%M:%S GMT")
-    render_ip = get_host_ip()
-    location = f'http://{render_ip}:{render_port}/description.xml'
-    uuid_str = get_uuid(render_port)
+    return f'Date: {date_str}\r\n\r\n'.encode('utf-8')
+
+
+def build_m_search_response(st, render, render_ip=None):
+    # everything but the Date header, which goes last, see get_date_header
+    location = get_location(render, render_ip or get_host_ip())
+    uuid_str = render.get('uuid') or get_uuid(render['port'])
 
     text = 'HTTP/1.1 200 OK\r\n'
     if st == ST_VALUE_MEDIARENDERER:
@@ -124,12 +281,104 @@ def build_m_search_response(st, render_port):
         text += f'USN: uuid:{uuid_str}::urn:schemas-upnp-org:service:AVTransport:1\r\n'
     text += f'Location: {location}\r\n'
     text += 'EXT: \r\n'
-    text += 'Server: Werkzeug/3.0 TinyRender/0.6\r\n'
-    text += 'Cache-Control: max-age=70\r\n'
-    text += f'Date: {date_str}\r\n\r\n'
+    text += f'Server: {SERVER_HEADER}\r\n'
+    text += f'Cache-Control: max-age={MAX_AGE}\r\n'
     return text.encode('utf-8')
 
 
+def get_notify_targets(uuid_str):
+    # (NT, USN) pairs a MediaRenderer announces, UPnP 1.0 section 1.1.2
+    targets = [
+        ('upnp:rootdevice', f'uuid:{uuid_str}::upnp:rootdevice'),
+        (f'uuid:{uuid_str}', f'uuid:{uuid_str}'),
+    ]
+    for nt in ('urn:schemas-upnp-org:device:MediaRenderer:1',
+               'urn:schemas-upnp-org:service:AVTransport:1',
+               'urn:schemas-upnp-org:service:RenderingControl:1',
+               'urn:schemas-upnp-org:service:ConnectionManager:1'):
+        targets.append((nt, f'uuid:{uuid_str}::{nt}'))
+    return targets
+
+
+def build_notify_messages(nts, render, render_ip=None):
+    uuid_str = render.get('uuid') or get_uuid(render['port'])
+    render_ip = render_ip or get_host_ip()
+    group = SSDP_MULTICAST_IP6 if ':' in render_ip else SSDP_MULTICAST_IP
+    messages = []
+    for nt, usn in get_notify_targets(uuid_str):
+        text = 'NOTIFY * HTTP/1.1\r\n'
+        text += f'HOST: {format_url_host(group)}:{SSDP_PORT}\r\n'
+        text += f'NT: {nt}\r\n'
+        text += f'NTS: {nts}\r\n'
+        text += f'USN: {usn}\r\n'
+        if nts == 'ssdp:alive':
+            text += f'LOCATION: {get_location(render, render_ip)}\r\n'
+            text += f'CACHE-CONTROL: max-age={MAX_AGE}\r\n'
+            text += f'SERVER: {SERVER_HEADER}\r\n'
+        text += '\r\n'
+        messages.append(text.encode('utf-8'))
+    return messages
+
+
+def get_multicast_interfaces(ipv6=False):
+    # where we announce: every IPv4 address, and with `ipv6` each IPv6
+    # link once, from its most useful address
+    result = {}
+    for iface in interfaces.get():
+        if iface.network.version == 4:
+            result[iface.ip] = iface
+        elif ipv6 and iface.index:
+            key = f'%{iface.index}'
+            other = result.get(key)
+            if other is None or ipaddress.ip_address(other.ip).is_link_local:
+                result[key] = iface
+    return result
+
+
+def get_multicast_addr(iface):
+    if iface.network.version == 4:
+        return SSDP_MULTICAST_IP, SSDP_PORT
+    return SSDP_MULTICAST_IP6, SSDP_PORT, 0, iface.index
+
+
+def open_multicast_sender(iface):
+    # a socket sending multicast out of `iface` only
+    if iface.network.version == 4:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(iface.ip))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+    else:
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, iface.index)
+    return sock
+
+
+def join_ssdp_group(sock, iface):
+    if sock.family == socket.AF_INET:
+        mreq = socket.inet_aton(SSDP_MULTICAST_IP) + socket.inet_aton(iface.ip)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    else:
+        mreq = socket.inet_pton(socket.AF_INET6, SSDP_MULTICAST_IP6) + struct.pack('@I', iface.index)
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, mreq)
+
+
+def send_byebye(render):
+    # any socket can say goodbye, no need to own the SSDP port for this
+    for iface in get_multicast_interfaces(ipv6=True).values():
+        try:
+            sock = open_multicast_sender(iface)
+        except OSError as e:
+            logger.debug(f'failed to send ssdp:byebye on {iface.name}: {e}')
+            continue
+        try:
+            for message in build_notify_messages('ssdp:byebye', render, iface.ip):
+                sock.sendto(message, get_multicast_addr(iface))
+        except OSError as e:
+            logger.debug(f'failed to send ssdp:byebye on {iface.name}: {e}')
+        finally:
+            sock.close()
+
+
 def get_search_target(data):
     if b':device:MediaRenderer:1' in data:
         return ST_VALUE_MEDIARENDERER
@@ -137,30 +386,294 @@ def get_search_target(data):
         return ST_VALUE_AVTRANSPORT
 
 
-def _get_live_render_ports():
+def _get_live_renders():
     config_file = get_config_file('live-renders.json')
     if not os.path.exists(config_file):
         return []
 
     with open(config_file) as f:
         configs = json.load(f)
-        return [x['port'] for x in configs.get('renders', [])]
-
-
-def ssdp_listener():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.bind(('0.0.0.0', SSDP_PORT))
-    logger.debug(f'SSDP server running at {SSDP_PORT}')
-
-    # Join the SSDP multicast group
-    mreq = socket.inet_aton(SSDP_MULTICAST_IP) + socket.inet_aton('0.0.0.0')
-    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-
-    while True:
-        data, addr = sock.recvfrom(1024)
+        return configs.get('renders', [])
+
+
+class RenderRegistry:
+    # live renders held in memory: live-renders.json is only re-read when
+    # its stat changes (checked at most once per REGISTRY_CHECK_INTERVAL,
+    # or right away after this process (un)registers a render), and
+    # responses are serialized once per (ST, local address, render)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.renders = []
+        self.file_key = None
+        self.checked_at = 0
+        self.interfaces_version = None
+        self.responses = {}
+        self.date_second = None
+        self.date_header = b''
+
+    def invalidate(self):
+        with self.lock:
+            self.checked_at = 0
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.checked_at >= REGISTRY_CHECK_INTERVAL:
+            self.checked_at = now
+            config_file = get_config_file('live-renders.json')
+            try:
+                st = os.stat(config_file)
+                file_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                file_key = None
+
+            if file_key != self.file_key:
+                try:
+                    self.renders = _get_live_renders()
+                except (OSError, ValueError) as e:
+                    logger.error(f'failed to load live renders: {e}')
+                else:
+                    self.file_key = file_key
+                    self.responses = {}
+                    logger.debug(f'loaded {len(self.renders)} live renders')
+
+        interfaces.get()
+        if interfaces.version != self.interfaces_version:
+            # addresses we answered with may be gone
+            self.interfaces_version = interfaces.version
+            self.responses = {}
+
+    def get_renders(self):
+        with self.lock:
+            self.refresh()
+            return self.renders
+
+    def get_responses(self, st, render_ip):
+        with self.lock:
+            self.refresh()
+
+            responses = self.responses.get((st, render_ip))
+            if responses is None:
+                responses = [
+                    build_m_search_response(st, render, render_ip)
+                    for render in self.renders
+                ]
+                self.responses[(st, render_ip)] = responses
+
+            second = int(time.time())
+            if second != self.date_second:
+                self.date_second = second
+                self.date_header = get_date_header()
+            date_header = self.date_header
+
+        return [head + date_header for head in responses]
+
+
+registry = RenderRegistry()
+
+
+def get_mx(data):
+    m = re.search(rb'\r\nMX:\s*(\d+)', data, re.I)
+    if not m:
+        # unicast searches carry no MX and want an answer right away
+        return 0
+    return min(int(m.group(1)), MX_MAX)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class SSDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, responder):
+        self.responder = responder
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
         if b'M-SEARCH' in data and b'ssdp:discover' in data:
-            st = get_search_target(data)
-            logger.info(f'Received M-SEARCH from {addr}, sending response...')
-            for render_port in _get_live_render_ports():
-                sock.sendto(build_m_search_response(st, render_port), addr)
+            self.responder.handle_search(data, addr, self.transport)
+
+    def error_received(self, exc):
+        logger.debug(f'SSDP socket error: {exc}')
+
+
+class SSDPResponder:
+    # runs on an asyncio loop: searches are answered from datagram
+    # callbacks, responses and announcements are loop timers
+    def __init__(self, loop, ipv6=False):
+        self.loop = loop
+        self.ipv6 = ipv6
+        # (addr, st, mx) -> when we last accepted a search from it
+        self.seen = {}
+        self.bucket = TokenBucket(RATE_PER_SECOND, RATE_BURST)
+        # key from get_multicast_interfaces() -> (interface, transport)
+        self.senders = {}
+        # transports of the sockets bound to the SSDP port
+        self.listeners = []
+        self.interfaces_version = None
+        self.announced = set()
+        self.next_announce = 0
+
+    def handle_search(self, data, addr, transport):
+        st = get_search_target(data)
+        mx = get_mx(data)
+        now = time.monotonic()
+        # a unicast search (no MX) right after a multicast one is not a
+        # repeat, the sender wants a quick answer
+        key = (addr, st, mx)
+        if now - self.seen.get(key, -DEDUP_WINDOW) < DEDUP_WINDOW:
+            logger.debug(f'dropping repeated M-SEARCH from {addr}')
+            return
+        self.seen[key] = now
+
+        logger.info(f'Received M-SEARCH from {addr}, MX {mx}, scheduling responses...')
+        # the Location has to be reachable from where the search came
+        scope_id = addr[3] if len(addr) > 3 else 0
+        render_ip = get_local_ip(addr[0], scope_id)
+        for response in registry.get_responses(st, render_ip):
+            # spread over MX as UPnP asks, so that the responses of all
+            # devices on the network do not arrive in one burst
+            self.loop.call_later(random.uniform(0, mx), self.send, response, addr, transport)
+
+    def send(self, data, addr, transport, limited=True):
+        if limited and not self.bucket.take():
+            logger.debug(f'rate limited, dropping response to {addr}')
+            return
+        transport.sendto(data, addr)
+
+    async def update_interfaces(self):
+        # join the group and open a sender on interfaces that came up;
+        # True when anything changed
+        wanted = get_multicast_interfaces(self.ipv6)
+        if interfaces.version == self.interfaces_version:
+            return False
+        self.interfaces_version = interfaces.version
+
+        for key in list(self.senders):
+            if wanted.get(key) != self.senders[key][0]:
+                self.senders.pop(key)[1].close()
+
+        for key, iface in wanted.items():
+            if key in self.senders:
+                continue
+            for transport in self.listeners:
+                sock = transport.get_extra_info('socket')
+                if sock.family != (socket.AF_INET if iface.network.version == 4 else socket.AF_INET6):
+                    continue
+                try:
+                    join_ssdp_group(sock, iface)
+                except OSError as e:
+                    # e.g. joined already through another address
+                    logger.debug(f'failed to join SSDP group on {iface.name} {iface.ip}: {e}')
+            try:
+                transport, _ = await self.loop.create_datagram_endpoint(
+                    asyncio.DatagramProtocol, sock=open_multicast_sender(iface))
+            except OSError as e:
+                logger.debug(f'no multicast on {iface.name} {iface.ip}: {e}')
+                continue
+            self.senders[key] = (iface, transport)
+        return True
+
+    def announce(self, renders, repeat=1):
+        # ssdp:alive for `renders` out of every interface, with the
+        # Location of that interface, spread over a short while like our
+        # M-SEARCH responses; these are few and never rate limited
+        for iface, transport in self.senders.values():
+            addr = get_multicast_addr(iface)
+            for render in renders:
+                for message in build_notify_messages('ssdp:alive', render, iface.ip):
+                    for i in range(repeat):
+                        delay = i * 0.5 + random.uniform(0, 0.1)
+                        self.loop.call_later(delay, self.send, message, addr, transport, False)
+
+    async def check_announcements(self):
+        now = time.monotonic()
+        changed = await self.update_interfaces()
+        renders = registry.get_renders()
+        if changed or now >= self.next_announce:
+            self.next_announce = now + NOTIFY_INTERVAL + random.uniform(0, NOTIFY_JITTER)
+            # on a new interface every render is new
+            self.announce(renders, repeat=2 if changed else 1)
+        else:
+            # new renders are announced right away, twice, as UDP is lossy
+            fresh = [r for r in renders if r.get('uuid') not in self.announced]
+            self.announce(fresh, repeat=2)
+        self.announced = {r.get('uuid') for r in renders}
+
+    def expire_seen(self):
+        now = time.monotonic()
+        for key, seen_at in list(self.seen.items()):
+            if now - seen_at >= DEDUP_WINDOW:
+                del self.seen[key]
+
+    async def run(self):
+        # the registry is looked at once per REGISTRY_CHECK_INTERVAL, so
+        # is the rest of the housekeeping
+        while True:
+            await self.check_announcements()
+            self.expire_seen()
+            await asyncio.sleep(REGISTRY_CHECK_INTERVAL)
+
+    def close(self):
+        for transport in self.listeners:
+            transport.close()
+        for _, transport in self.senders.values():
+            transport.close()
+
+
+async def serve_ssdp(ipv6=False):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    # closed whatever happens, we are tried again when failing
+    socks = [sock]
+    responder = None
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('0.0.0.0', SSDP_PORT))
+        logger.debug(f'SSDP server running at {SSDP_PORT}')
+
+        if not get_multicast_interfaces():
+            # nothing but loopback, let the kernel pick
+            mreq = socket.inet_aton(SSDP_MULTICAST_IP) + socket.inet_aton('0.0.0.0')
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+
+        if ipv6:
+            try:
+                sock6 = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+                socks.append(sock6)
+                sock6.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock6.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+                sock6.bind(('::', SSDP_PORT))
+            except OSError as e:
+                logger.error(f'no IPv6 SSDP: {e}')
+                ipv6 = False
+                if len(socks) > 1:
+                    socks.pop().close()
+
+        # groups are joined per interface as they show up
+        responder = SSDPResponder(loop, ipv6)
+        for sock in socks:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: SSDPProtocol(responder), sock=sock)
+            responder.listeners.append(transport)
+        await responder.run()
+    finally:
+        if responder:
+            responder.close()
+        for sock in socks:
+            sock.close()
@@ -0,0 +1,332 @@
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import select
+import socket
+import socketserver
+import threading
+import time
+
+from .tiny_ssdp import SSDP_MULTICAST_IP, SSDP_PORT, get_config_file
+from .tiny_ssdp import get_multicast_interfaces, interfaces, join_ssdp_group
+
+logger = logging.getLogger('tiny_watch')
+
+SOCKET_NAME = 'watch.sock'
+AVTRANSPORT_TYPE = 'urn:schemas-upnp-org:service:AVTransport:1'
+# used when a device does not send `Cache-Control: max-age`
+DEFAULT_MAX_AGE = 1800
+# devices announce themselves, we only search now and then to catch the
+# ones that are quiet about it
+SEARCH_INTERVAL = 300
+# the table is only trusted after the first search had time to complete
+WARMUP = 2.5
+FETCH_WORKERS = 8
+CLIENT_TIMEOUT = 0.5
+
+MSEARCH_MSG = (
+    'M-SEARCH * HTTP/1.1\r\n'
+    f'HOST: {SSDP_MULTICAST_IP}:{SSDP_PORT}\r\n'
+    'MAN: "ssdp:discover"\r\n'
+    'MX: 1\r\n'
+    f'ST: {AVTRANSPORT_TYPE}\r\n'
+    '\r\n'
+)
+
+
+def get_socket_path():
+    return get_config_file(SOCKET_NAME)
+
+
+def parse_ssdp_message(data):
+    # returns (start line, headers with lower-cased names)
+    lines = data.decode('utf-8', 'replace').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        k, sep, v = line.partition(':')
+        if sep:
+            headers[k.strip().lower()] = v.strip()
+    return lines[0], headers
+
+
+def get_max_age(headers):
+    m = re.search(r'max-age\s*=\s*(\d+)', headers.get('cache-control', ''), re.I)
+    return int(m.group(1)) if m else DEFAULT_MAX_AGE
+
+
+class DeviceTable:
+    # AVTransport devices by USN, with their description already fetched
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.fetching = set()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+
+    def alive(self, usn, location, max_age, st=AVTRANSPORT_TYPE):
+        expires_at = time.monotonic() + max_age
+        with self.lock:
+            device = self.devices.get(usn)
+            if device and device['location'] == location:
+                device['max_age'] = max_age
+                device['expires_at'] = expires_at
+                return
+            if location in self.fetching:
+                return
+            self.fetching.add(location)
+
+        logger.debug(f'new device {usn} at {location}')
+        device = {'location': location, 'usn': usn, 'st': st, 'max_age': max_age}
+        future = self.pool.submit(self.fetch, device)
+        future.add_done_callback(
+            lambda f: self.fetched(usn, location, expires_at, f))
+
+    def fetched(self, usn, location, expires_at, future):
+        device = None if future.cancelled() else future.result()
+        with self.lock:
+            self.fetching.discard(location)
+            if device and device.get('control_url'):
+                device['expires_at'] = expires_at
+                self.devices[usn] = device
+
+    def byebye(self, usn):
+        # a byebye for the root device or its uuid ends all its services
+        device_uuid = usn.split('::')[0]
+        with self.lock:
+            for key in list(self.devices):
+                if key.split('::')[0] == device_uuid:
+                    logger.debug(f'device left: {key}')
+                    del self.devices[key]
+
+    def expire(self):
+        now = time.monotonic()
+        with self.lock:
+            for key, device in list(self.devices.items()):
+                if device['expires_at'] < now:
+                    logger.debug(f'device expired: {key}')
+                    del self.devices[key]
+
+    def get_devices(self):
+        self.expire()
+        with self.lock:
+            return [
+                {k: v for k, v in d.items() if k != 'expires_at'}
+                for d in self.devices.values()
+            ]
+
+
+class DeviceWatcher:
+    def __init__(self, fetch):
+        self.table = DeviceTable(fetch)
+        self.started_at = time.monotonic()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('0.0.0.0', SSDP_PORT))
+        self.joined = set()
+        self.interfaces_version = None
+        if not get_multicast_interfaces():
+            # nothing but loopback, let the kernel pick
+            mreq = socket.inet_aton(SSDP_MULTICAST_IP) + socket.inet_aton('0.0.0.0')
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        # searches go out from a port of their own: unicast replies to the
+        # shared SSDP port would only reach one of the processes bound to
+        # it, e.g. a tiny-render on this host
+        self.search_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.search_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+
+    def is_ready(self):
+        return time.monotonic() - self.started_at > WARMUP
+
+    def update_interfaces(self):
+        # join the group on interfaces that came up since we last looked,
+        # which are returned; the host's interfaces are read again at
+        # most every HOST_IP_CHECK_INTERVAL
+        ifaces = get_multicast_interfaces()
+        if interfaces.version == self.interfaces_version:
+            return []
+        self.interfaces_version = interfaces.version
+        # one that went away is joined again if it comes back
+        self.joined &= set(ifaces)
+        new = []
+        for iface in ifaces.values():
+            if iface.ip in self.joined:
+                continue
+            try:
+                join_ssdp_group(self.sock, iface)
+            except OSError as e:
+                logger.debug(f'failed to join SSDP group on {iface.name}: {e}')
+            self.joined.add(iface.ip)
+            new.append(iface)
+        return new
+
+    def search(self, ifaces=None):
+        # on `ifaces`, every interface for None
+        msg = MSEARCH_MSG.encode('utf-8')
+        if ifaces is None:
+            ifaces = get_multicast_interfaces().values()
+            if not ifaces:
+                try:
+                    self.search_sock.sendto(msg, (SSDP_MULTICAST_IP, SSDP_PORT))
+                except OSError as e:
+                    logger.debug(f'failed to send M-SEARCH: {e}')
+        for iface in ifaces:
+            try:
+                self.search_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                            socket.inet_aton(iface.ip))
+                self.search_sock.sendto(msg, (SSDP_MULTICAST_IP, SSDP_PORT))
+            except OSError as e:
+                logger.debug(f'failed to send M-SEARCH on {iface.name}: {e}')
+
+    def handle(self, data):
+        start_line, headers = parse_ssdp_message(data)
+        usn = headers.get('usn')
+        if not usn:
+            return
+
+        if start_line.startswith('NOTIFY'):
+            nts = headers.get('nts', '')
+            if nts == 'ssdp:byebye':
+                self.table.byebye(usn)
+                return
+            target = headers.get('nt', '')
+        elif start_line.endswith('200 OK'):
+            nts = 'ssdp:alive'
+            target = headers.get('st', '')
+        else:
+            # somebody else searching
+            return
+
+        if nts in ('ssdp:alive', 'ssdp:update') and ':service:AVTransport:' in target:
+            location = headers.get('location')
+            if location:
+                self.table.alive(usn, location, get_max_age(headers), target)
+
+    def run(self):
+        next_search = 0
+        while True:
+            now = time.monotonic()
+            new = self.update_interfaces()
+            if now >= next_search:
+                next_search = now + SEARCH_INTERVAL
+                self.search()
+            elif new:
+                # their devices may not announce themselves for a while
+                logger.debug(f'new interfaces: {[iface.name for iface in new]}')
+                self.search(new)
+
+            timeout = max(min(next_search - now, 1.0), 0)
+            readable, _, _ = select.select([self.sock, self.search_sock], [], [], timeout)
+            if not readable:
+                self.table.expire()
+            for sock in readable:
+                try:
+                    data, addr = sock.recvfrom(2048)
+                except OSError as e:
+                    logger.debug(f'recvfrom failed: {e}')
+                    continue
+                self.handle(data)
+
+
+class WatchRequestHandler(socketserver.StreamRequestHandler):
+    timeout = CLIENT_TIMEOUT
+
+    def handle(self):
+        try:
+            command = self.rfile.readline().strip()
+        except OSError:
+            return
+        if command != b'list':
+            return
+
+        watcher = self.server.watcher
+        reply = {
+            'ready': watcher.is_ready(),
+            'devices': watcher.table.get_devices(),
+        }
+        self.wfile.write(json.dumps(reply, ensure_ascii=False).encode('utf-8'))
+
+
+# the watcher answers on a unix socket; without them (older Windows)
+# there is no watcher and the cli searches the network every time
+HAS_UNIX_SOCKETS = hasattr(socket, 'AF_UNIX')
+
+if HAS_UNIX_SOCKETS:
+    class WatchServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path, watcher):
+            self.watcher = watcher
+            super().__init__(path, WatchRequestHandler)
+
+
+def is_watcher_running(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def run_watcher(fetch):
+    # `fetch(device)` resolves a device from its SSDP headers, i.e. adds
+    # friendly_name and control_url, or returns None
+    if not HAS_UNIX_SOCKETS:
+        logger.error('watch needs unix sockets, not available on this platform')
+        exit(1)
+    path = get_socket_path()
+    if os.path.exists(path):
+        if is_watcher_running(path):
+            logger.error(f'another watcher is running at {path}')
+            exit(1)
+        # left over from a watcher that did not exit cleanly
+        os.unlink(path)
+
+    watcher = DeviceWatcher(fetch)
+    server = WatchServer(path, watcher)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f'watching for DLNA devices, answering at {path}')
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def get_watched_devices():
+    # the device table of a running watcher, or None when there is no
+    # watcher (or it has only just started)
+    if not HAS_UNIX_SOCKETS:
+        return None
+    path = get_socket_path()
+    if not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CLIENT_TIMEOUT)
+    try:
+        sock.connect(path)
+        sock.sendall(b'list\n')
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        reply = json.loads(b''.join(chunks))
+    except (OSError, ValueError) as e:
+        logger.debug(f'watcher did not answer: {e}')
+        return None
+    finally:
+        sock.close()
+
+    if not reply.get('ready'):
+        return None
+    return reply.get('devices', [])
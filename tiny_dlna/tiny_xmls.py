@@ -56,6 +56,18 @@ XML_STOP = """<?xml version='1.0' encoding='utf-8'?>
 </s:Envelope>
 """
 
+XML_GET_TRANSINFO = """<?xml version='1.0' encoding='utf-8'?>
+<s:Envelope
+    xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"
+    s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
+  <s:Body>
+    <u:GetTransportInfo xmlns:u="urn:schemas-upnp-org:service:AVTransport:1">
+      <InstanceID>0</InstanceID>
+    </u:GetTransportInfo>
+  </s:Body>
+</s:Envelope>
+"""
+
 XML_SEEK_PTN = """<?xml version="1.0" encoding="utf-8"?>
 <s:Envelope
     xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"
@@ -78,8 +90,8 @@ XML_DESC_PTN = """<?xml version="1.0" encoding="UTF-8"?>
   </specVersion>
   <device>
     <deviceType>urn:schemas-upnp-org:device:MediaRenderer:1</deviceType>
-    <friendlyName>{}</friendlyName>
-    <UDN>uuid:{}</UDN>
+    <friendlyName>{0}</friendlyName>
+    <UDN>uuid:{1}</UDN>
     <manufacturer>mitnk</manufacturer>
     <modelName>Tiny-Render</modelName>
     <modelDescription>AVTransport Media Renderer</modelDescription>
@@ -88,22 +100,23 @@ XML_DESC_PTN = """<?xml version="1.0" encoding="UTF-8"?>
       <service>
         <serviceType>urn:schemas-upnp-org:service:AVTransport:1</serviceType>
         <serviceId>urn:upnp-org:serviceId:AVTransport</serviceId>
-        <controlURL>AVTransport/control</controlURL>
-        <SCPDURL>dlna/AVTransport.xml</SCPDURL>
+        <controlURL>{2}AVTransport/control</controlURL>
+        <eventSubURL>{2}AVTransport/event</eventSubURL>
+        <SCPDURL>{2}dlna/AVTransport.xml</SCPDURL>
       </service>
       <service>
         <serviceType>urn:schemas-upnp-org:service:RenderingControl:1</serviceType>
         <serviceId>urn:upnp-org:serviceId:RenderingControl</serviceId>
-        <controlURL>RenderingControl/action</controlURL>
-        <eventSubURL>RenderingControl/event</eventSubURL>
-        <SCPDURL>dlna/RenderingControl.xml</SCPDURL>
+        <controlURL>{2}RenderingControl/action</controlURL>
+        <eventSubURL>{2}RenderingControl/event</eventSubURL>
+        <SCPDURL>{2}dlna/RenderingControl.xml</SCPDURL>
       </service>
       <service>
         <serviceType>urn:schemas-upnp-org:service:ConnectionManager:1</serviceType>
         <serviceId>urn:upnp-org:serviceId:ConnectionManager</serviceId>
-        <controlURL>ConnectionManager/action</controlURL>
-        <eventSubURL>ConnectionManager/event</eventSubURL>
-        <SCPDURL>dlna/ConnectionManager.xml</SCPDURL>
+        <controlURL>{2}ConnectionManager/action</controlURL>
+        <eventSubURL>{2}ConnectionManager/event</eventSubURL>
+        <SCPDURL>{2}dlna/ConnectionManager.xml</SCPDURL>
       </service>
     </serviceList>
   </device>
@@ -138,7 +151,7 @@ XML_POSINFO = """
   <s:Body>
     <u:GetPositionInfoResponse xmlns:u="urn:schemas-upnp-org:service:AVTransport:1">
       <Track>0</Track>
-      <TrackDuration>01:23:45</TrackDuration>
+      <TrackDuration>{1}</TrackDuration>
       <RelTime>{0}</RelTime>
       <AbsTime>{0}</AbsTime>
       <RelCount>2147483647</RelCount>
@@ -152,7 +165,7 @@ XML_TRANSINFO = """
 <s:Envelope s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
   <s:Body>
     <u:GetTransportInfoResponse xmlns:u="urn:schemas-upnp-org:service:AVTransport:1">
-      <CurrentTransportState>PLAYING</CurrentTransportState>
+      <CurrentTransportState>{}</CurrentTransportState>
       <CurrentTransportStatus>OK</CurrentTransportStatus>
       <CurrentSpeed>1</CurrentSpeed>
     </u:GetTransportInfoResponse>
@@ -168,6 +181,31 @@ XML_STOP_DONE = """
 </s:Envelope>
 """
 
+XML_ACTION_DONE = """
+<s:Envelope s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <u:{1}Response xmlns:u="{0}">{2}</u:{1}Response>
+  </s:Body>
+</s:Envelope>
+"""
+
+XML_SOAP_FAULT = """<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <s:Fault>
+      <faultcode>s:Client</faultcode>
+      <faultstring>UPnPError</faultstring>
+      <detail>
+        <UPnPError xmlns="urn:schemas-upnp-org:control-1-0">
+          <errorCode>{0}</errorCode>
+          <errorDescription>{1}</errorDescription>
+        </UPnPError>
+      </detail>
+    </s:Fault>
+  </s:Body>
+</s:Envelope>
+"""
+
 XML_DLNA_AVT = """<?xml version="1.0" encoding="UTF-8"?>
 <scpd xmlns="urn:schemas-upnp-org:service-1-0">
 <specVersion>
@@ -451,6 +489,26 @@ XML_DLNA_AVT = """<?xml version="1.0" encoding="UTF-8"?>
 </argumentList>
 </action>
 <action>
+<name>SetNextAVTransportURI</name>
+<argumentList>
+<argument>
+<name>InstanceID</name>
+<direction>in</direction>
+<relatedStateVariable>A_ARG_TYPE_InstanceID</relatedStateVariable>
+</argument>
+<argument>
+<name>NextURI</name>
+<direction>in</direction>
+<relatedStateVariable>NextAVTransportURI</relatedStateVariable>
+</argument>
+<argument>
+<name>NextURIMetaData</name>
+<direction>in</direction>
+<relatedStateVariable>NextAVTransportURIMetaData</relatedStateVariable>
+</argument>
+</argumentList>
+</action>
+<action>
 <name>SetPlayMode</name>
 <argumentList>
 <argument>